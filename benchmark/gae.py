@@ -0,0 +1,77 @@
+# Compares the GAE and returns computation of `gym_microrts.torch_utils` (a parallel scan over the
+# steps) with the python loop over the steps the PPO trainers used, which launches a few kernels
+# per step.
+#
+#   python benchmark/gae.py --num-envs 24 --num-steps 256 2048
+
+import argparse
+import time
+
+import torch
+
+from gym_microrts.torch_utils import compute_gae
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, default=24,
+        help='the number of parallel game environments')
+    parser.add_argument('--num-steps', type=int, nargs='+', default=[256, 2048],
+        help='the numbers of steps of a rollout')
+    parser.add_argument('--repeats', type=int, default=20,
+        help='the number of timed computations')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu',
+        help='the device of the rollout tensors')
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+def loop_gae(rewards, values, dones, last_value, next_done, gamma, gae_lambda):
+    num_steps = len(rewards)
+    advantages = torch.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(num_steps)):
+        if t == num_steps - 1:
+            nextnonterminal = 1.0 - next_done
+            nextvalues = last_value
+        else:
+            nextnonterminal = 1.0 - dones[t + 1]
+            nextvalues = values[t + 1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advantages[t] = lastgaelam = delta + gamma * gae_lambda * nextnonterminal * lastgaelam
+    return advantages, advantages + values
+
+
+def timeit(fn, device, repeats):
+    fn()  # warm up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+    print(f"{'num_steps':>10} {'loop ms':>9} {'scan ms':>9} {'speedup':>8} {'max abs diff':>13}")
+    for num_steps in args.num_steps:
+        rewards = torch.randn(num_steps, args.num_envs, device=device)
+        values = torch.randn(num_steps, args.num_envs, device=device)
+        dones = (torch.rand(num_steps, args.num_envs, device=device) < 0.01).float()
+        last_value = torch.randn(1, args.num_envs, device=device)
+        next_done = torch.zeros(args.num_envs, device=device)
+        rollout = (rewards, values, dones, last_value, next_done, 0.99, 0.95)
+
+        with torch.no_grad():
+            loop_time = timeit(lambda: loop_gae(*rollout), device, args.repeats)
+            scan_time = timeit(lambda: compute_gae(*rollout), device, args.repeats)
+            diff = (loop_gae(*rollout)[0] - compute_gae(*rollout)[0]).abs().max().item()
+        print(
+            f"{num_steps:>10} {loop_time * 1000:>9.2f} {scan_time * 1000:>9.2f} {loop_time / scan_time:>7.1f}x {diff:>13.2e}"
+        )
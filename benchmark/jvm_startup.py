@@ -0,0 +1,82 @@
+# Measures the JVM startup time and memory of loading all the bot jars vs only the jars of the
+# AIs that are played against, with and without an AppCDS archive. Each run happens in a fresh
+# python process, which starts the JVM, creates the unit type table and the AIs.
+#
+#   python benchmark/jvm_startup.py --ais coacAI --repeats 5
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import gym_microrts
+
+CONFIGS = {
+    "all jars": dict(selective=False, cds=False),
+    "selective": dict(selective=True, cds=False),
+    "selective+cds": dict(selective=True, cds=True),
+}
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ais', type=str, nargs='+', default=['coacAI'],
+        help='the AIs of `gym_microrts.microrts_ai` to create')
+    parser.add_argument('--repeats', type=int, default=5,
+        help='the number of fresh processes of each config')
+    parser.add_argument('--microrts-path', type=str, default=os.path.join(gym_microrts.__path__[0], "microrts"),
+        help='the microrts directory holding `microrts.jar` and `lib/bots`')
+    parser.add_argument('--run', type=str, default=None,
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024
+
+
+def run(args):
+    config = CONFIGS[args.run]
+    start = time.perf_counter()
+    from gym_microrts import microrts_ai
+    from gym_microrts.microrts_jvm import start_jvm
+
+    ais = [getattr(microrts_ai, ai) for ai in args.ais]
+    start_jvm(args.microrts_path, ais=ais if config["selective"] else None, cds=config["cds"])
+    from rts.units import UnitTypeTable
+
+    utt = UnitTypeTable()
+    for ai in ais:
+        ai(utt)
+    print(time.perf_counter() - start, rss_mb())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.run is not None:
+        run(args)
+        sys.exit(0)
+
+    print(f"{'config':>14} {'time (s)':>9} {'rss (MB)':>9}")
+    for name in CONFIGS:
+        results = []
+        # the first cds run dumps the archive, which the following ones load
+        for _ in range(args.repeats + int(CONFIGS[name]["cds"])):
+            output = subprocess.run(
+                [sys.executable, __file__, "--run", name, "--microrts-path", args.microrts_path, "--ais", *args.ais],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            ).stdout.split()
+            results.append([float(value) for value in output[-2:]])
+        times, rss = np.array(results[-args.repeats :]).T
+        print(f"{name:>14} {np.median(times):>9.3f} {np.median(rss):>9.0f}")
@@ -0,0 +1,82 @@
+# Compares `gym_microrts.torch_utils.masked_multi_categorical` (all the components of the gridnet
+# actions sampled in one pass) with one masked `Categorical` per component, as the PPO trainers
+# did, when sampling the actions of a rollout step and when evaluating a minibatch with gradients.
+#
+#   python benchmark/multi_categorical.py --num-envs 24 --map-size 256
+
+import argparse
+import time
+
+import torch
+from torch.distributions.categorical import Categorical
+
+from gym_microrts.torch_utils import masked_multi_categorical
+
+NVEC = [6, 4, 4, 4, 4, 7, 49]
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, default=24,
+        help='the number of parallel game environments')
+    parser.add_argument('--map-size', type=int, default=256,
+        help='the number of cells of the map, e.g. 256 for 16x16')
+    parser.add_argument('--repeats', type=int, default=20,
+        help='the number of timed computations')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu',
+        help='the device of the logits')
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+def per_component(logits, masks, nvec, actions=None, mask_value=-1e8):
+    mask_value = torch.tensor(mask_value, device=logits.device)
+    categoricals = [
+        Categorical(logits=torch.where(component_masks, component_logits, mask_value))
+        for component_logits, component_masks in zip(torch.split(logits, nvec, dim=-1), torch.split(masks, nvec, dim=-1))
+    ]
+    if actions is None:
+        actions = torch.stack([categorical.sample() for categorical in categoricals], -1)
+    log_prob = torch.stack([categorical.log_prob(a) for a, categorical in zip(actions.T, categoricals)]).sum(0)
+    entropy = torch.stack([categorical.entropy() for categorical in categoricals]).sum(0)
+    return actions, log_prob, entropy
+
+
+def timeit(fn, device, repeats):
+    fn()  # warm up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+def evaluate(sampler, logits, masks, actions):
+    _, log_prob, entropy = sampler(logits, masks, NVEC, actions)
+    (log_prob.sum() + entropy.sum()).backward()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = torch.device(args.device)
+    logits = torch.randn(args.num_envs * args.map_size, sum(NVEC), device=device, requires_grad=True)
+    masks = torch.rand(args.num_envs * args.map_size, sum(NVEC), device=device) < 0.5
+    actions, _, _ = masked_multi_categorical(logits, masks, NVEC)
+
+    print(f"{'':>10} {'per component ms':>17} {'fused ms':>9} {'speedup':>8}")
+    with torch.no_grad():
+        times = [
+            timeit(lambda: sampler(logits, masks, NVEC), device, args.repeats)
+            for sampler in [per_component, masked_multi_categorical]
+        ]
+    print(f"{'sample':>10} {times[0] * 1000:>17.2f} {times[1] * 1000:>9.2f} {times[0] / times[1]:>7.2f}x")
+    times = [
+        timeit(lambda: evaluate(sampler, logits, masks, actions), device, args.repeats)
+        for sampler in [per_component, masked_multi_categorical]
+    ]
+    print(f"{'evaluate':>10} {times[0] * 1000:>17.2f} {times[1] * 1000:>9.2f} {times[0] / times[1]:>7.2f}x")
@@ -0,0 +1,111 @@
+# Measures the gain of overlapping the policy forward pass with game stepping on a CPU-only host.
+# The envs are split into two halves (A/B) with `num_threads=2`: the serial loop steps both halves
+# and then runs the policy on the whole batch, while the pipelined loop runs the policy on the half
+# that was just received (`recv`) while the other half is stepping in the background (`send`).
+#
+#   python benchmark/pipeline.py --num-bot-envs 24 --torch-threads 4
+
+import argparse
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from gym_microrts import microrts_ai
+from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-bot-envs', type=int, default=24,
+        help='the number of bot envs, split into two halves')
+    parser.add_argument('--ai', type=str, default='coacAI',
+        help='the bot of `gym_microrts.microrts_ai` played against')
+    parser.add_argument('--map-path', type=str, default='maps/16x16/basesWorkers16x16A.xml',
+        help='the map played on')
+    parser.add_argument('--num-steps', type=int, default=500,
+        help='the number of timed batches of each loop')
+    parser.add_argument('--torch-threads', type=int, default=1,
+        help='the number of threads used by torch')
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+class Policy(nn.Module):
+    """The encoder and actor of `experiments/ppo_gridnet.py`, sampling the masked actions with the Gumbel-max trick."""
+
+    def __init__(self, envs):
+        super().__init__()
+        h, w, c = envs.observation_space.shape
+        self.nvec = envs.action_plane_space.nvec.tolist()
+        self.net = nn.Sequential(
+            nn.Conv2d(c, 32, kernel_size=3, padding=1),
+            nn.MaxPool2d(3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(32, 64, kernel_size=3, padding=1),
+            nn.MaxPool2d(3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.ConvTranspose2d(64, 32, 3, stride=2, padding=1, output_padding=1),
+            nn.ReLU(),
+            nn.ConvTranspose2d(32, sum(self.nvec), 3, stride=2, padding=1, output_padding=1),
+        )
+
+    @torch.no_grad()
+    def forward(self, obs, masks):
+        logits = self.net(torch.from_numpy(obs).float().permute(0, 3, 1, 2)).permute(0, 2, 3, 1)
+        logits = logits.reshape(len(obs), -1, sum(self.nvec))
+        gumbels = -torch.log(-torch.log(torch.rand_like(logits)))
+        scores = torch.where(torch.from_numpy(masks).bool(), logits + gumbels, torch.tensor(-1e8))
+        actions = torch.stack([split.argmax(-1) for split in torch.split(scores, self.nvec, dim=-1)], -1)
+        return actions.reshape(len(obs), -1).numpy()
+
+
+def serial(envs, policy, num_steps):
+    obs, masks = envs.reset_with_masks()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        actions = policy(obs, masks)
+        obs, _, _, _, masks = envs.step_with_masks(actions)
+    return time.perf_counter() - start
+
+
+def pipelined(envs, policy, num_steps):
+    envs.async_reset()
+    num_received = 0
+    start = time.perf_counter()
+    # each half counts for half a batch
+    while num_received < num_steps * envs.num_envs:
+        obs, _, _, _, masks, env_ids = envs.recv()
+        envs.send(policy(obs, masks), env_ids)
+        num_received += len(env_ids)
+    elapsed = time.perf_counter() - start
+    while len(envs.pending_clients) > 0:
+        envs.recv()
+    return elapsed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    torch.set_num_threads(args.torch_threads)
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=args.num_bot_envs,
+        max_steps=2000,
+        ai2s=[getattr(microrts_ai, args.ai) for _ in range(args.num_bot_envs)],
+        map_paths=[args.map_path],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        num_threads=2,
+    )
+    policy = Policy(envs)
+    serial(envs, policy, 10)  # warm up
+    serial_time = serial(envs, policy, args.num_steps)
+    pipelined_time = pipelined(envs, policy, args.num_steps)
+    num_env_steps = args.num_steps * envs.num_envs
+    print(f"{'loop':>10} {'SPS':>8}")
+    print(f"{'serial':>10} {num_env_steps / serial_time:>8.0f}")
+    print(f"{'pipelined':>10} {num_env_steps / pipelined_time:>8.0f}")
+    print(f"overlap gain: {serial_time / pipelined_time:.2f}x")
+    envs.close()
@@ -0,0 +1,76 @@
+# Measures the cost of handing the grid actions to the JVM in `MicroRTSGridModeVecEnv.step_async`
+# as a function of the number of units that can act. Only a bare JVM is needed, so this runs
+# without building microrts.
+#
+#   python benchmark/step_async.py --num-envs 24 --map-size 16
+
+import argparse
+import time
+
+import jpype
+import numpy as np
+from jpype.types import JArray, JInt
+
+from gym_microrts.envs.vec_env import to_java_actions
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, default=24,
+        help='the number of environments')
+    parser.add_argument('--map-size', type=int, default=16,
+        help='the width (and height) of the map')
+    parser.add_argument('--unit-counts', nargs='+', type=int, default=[1, 4, 16, 64, 128, 256],
+        help='the number of units that can act in each environment')
+    parser.add_argument('--num-steps', type=int, default=200,
+        help='the number of timed steps per unit count')
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+def per_unit_java_actions(actions, source_unit_mask):
+    # the previous `step_async`: one JArray per unit
+    num_envs, num_cells = source_unit_mask.shape
+    source_unit_idxs = np.tile(np.arange(num_cells), (num_envs, 1)).reshape(num_envs, num_cells, 1)
+    actions = np.concatenate((source_unit_idxs, actions), 2)
+    actions = actions[np.where(source_unit_mask == 1)]
+    action_counts_per_env = source_unit_mask.sum(1)
+    java_actions = [None] * len(action_counts_per_env)
+    action_idx = 0
+    for outer_idx, action_count in enumerate(action_counts_per_env):
+        java_valid_action = [None] * action_count
+        for idx in range(action_count):
+            java_valid_action[idx] = JArray(JInt)(actions[action_idx])
+            action_idx += 1
+        java_actions[outer_idx] = JArray(JArray(JInt))(java_valid_action)
+    return JArray(JArray(JArray(JInt)))(java_actions)
+
+
+def time_per_step(fn, actions, source_unit_mask, num_steps):
+    fn(actions, source_unit_mask)  # warm up
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        fn(actions, source_unit_mask)
+    return (time.perf_counter() - start) / num_steps
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not jpype.isJVMStarted():
+        jpype.startJVM(convertStrings=False)
+
+    num_cells = args.map_size * args.map_size
+    rng = np.random.default_rng(0)
+    print(f"{'units/env':>10} {'per-unit (ms)':>14} {'bulk (ms)':>10} {'speedup':>8}")
+    for unit_count in args.unit_counts:
+        unit_count = min(unit_count, num_cells)
+        actions = rng.integers(0, 4, size=(args.num_envs, num_cells, 7)).astype(np.int32)
+        source_unit_mask = np.zeros((args.num_envs, num_cells), dtype=np.int32)
+        for i in range(args.num_envs):
+            source_unit_mask[i, rng.choice(num_cells, unit_count, replace=False)] = 1
+
+        per_unit = time_per_step(per_unit_java_actions, actions, source_unit_mask, args.num_steps)
+        bulk = time_per_step(to_java_actions, actions, source_unit_mask, args.num_steps)
+        print(f"{unit_count:>10} {per_unit * 1e3:>14.3f} {bulk * 1e3:>10.3f} {per_unit / bulk:>7.1f}x")
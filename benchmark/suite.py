@@ -0,0 +1,228 @@
+# Measures the throughput of the envs (steps/sec, per-step latency percentiles and RSS) across
+# the env classes, numbers of envs, map sizes and opponents, and writes the results as JSON to
+# track regressions between releases. Each config runs in a fresh python process, so that its RSS
+# and JVM startup are measured alone. The actions are sampled uniformly among the valid ones.
+#
+#   python benchmark/suite.py --output-path benchmark.json
+#   python benchmark/suite.py --env-classes grid shared_mem --num-envs 24 --maps maps/16x16/basesWorkers16x16A.xml --ais coacAI
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import gym_microrts
+
+ENV_CLASSES = ["grid", "shared_mem", "bot", "pettingzoo"]
+MAPS = [
+    "maps/8x8/basesWorkers8x8A.xml",
+    "maps/10x10/basesWorkers10x10.xml",
+    "maps/16x16/basesWorkers16x16A.xml",
+    "maps/24x24/basesWorkers24x24A.xml",
+    "maps/BWDistantResources32x32.xml",
+]
+REWARD_WEIGHT = np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0])
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env-classes', type=str, nargs='+', default=ENV_CLASSES, choices=ENV_CLASSES,
+        help='the envs to measure: `MicroRTSGridModeVecEnv`, `MicroRTSGridModeSharedMemVecEnv`, `MicroRTSBotVecEnv` (bot vs bot) and the PettingZoo wrapper')
+    parser.add_argument('--num-envs', type=int, nargs='+', default=[1, 8, 24],
+        help='the numbers of envs')
+    parser.add_argument('--maps', type=str, nargs='+', default=MAPS,
+        help='the maps played on')
+    parser.add_argument('--ais', type=str, nargs='+', default=['randomBiasedAI', 'workerRushAI', 'coacAI'],
+        help='the AIs of `gym_microrts.microrts_ai` played against')
+    parser.add_argument('--num-steps', type=int, default=500,
+        help='the number of timed steps of each config')
+    parser.add_argument('--num-warmup-steps', type=int, default=20,
+        help='the number of steps before timing')
+    parser.add_argument('--output-path', type=str, default='benchmark.json',
+        help='the JSON file the results are written to')
+    parser.add_argument('--run', type=str, default=None,
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024
+
+
+def sample_actions(masks, nvec):
+    """
+    :param masks: action masks of shape [..., sum(nvec)], as returned by `get_action_mask`
+    :return: actions of shape [..., len(nvec)], sampled uniformly among the valid ones
+    """
+    splits = np.split(masks, np.cumsum(nvec)[:-1], axis=-1)
+    return np.stack([np.argmax(np.random.rand(*split.shape) * split, -1) for split in splits], -1)
+
+
+def make_envs(config):
+    from gym_microrts import microrts_ai
+
+    ai = getattr(microrts_ai, config["ai"])
+    num_envs = config["num_envs"]
+    kwargs = dict(max_steps=2000, map_paths=[config["map_path"]], reward_weight=REWARD_WEIGHT)
+    if config["env_class"] == "grid":
+        from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
+
+        return MicroRTSGridModeVecEnv(num_selfplay_envs=0, num_bot_envs=num_envs, ai2s=[ai] * num_envs, **kwargs)
+    if config["env_class"] == "shared_mem":
+        from gym_microrts.envs.vec_env import MicroRTSGridModeSharedMemVecEnv
+
+        return MicroRTSGridModeSharedMemVecEnv(num_selfplay_envs=0, num_bot_envs=num_envs, ai2s=[ai] * num_envs, **kwargs)
+    if config["env_class"] == "bot":
+        from gym_microrts.envs.vec_env import MicroRTSBotVecEnv
+
+        return MicroRTSBotVecEnv(ai1s=[ai] * num_envs, ai2s=[ai] * num_envs, **kwargs)
+    from gym_microrts.petting_zoo_api import PettingZooMicroRTSGridModeSharedMemVecEnv
+
+    return PettingZooMicroRTSGridModeSharedMemVecEnv(
+        num_selfplay_envs=0, num_bot_envs=num_envs, ai2s=[ai] * num_envs, **kwargs
+    )
+
+
+def step_fn(envs, config):
+    """
+    :return: a function that samples the next actions, steps all the envs once and returns the
+    time taken by the env alone
+    """
+    num_envs = config["num_envs"]
+    if config["env_class"] == "bot":
+        # the actions of the bots are computed in the JVM
+        actions = [[[0] * 8, [0] * 8] for _ in range(num_envs)]
+
+        def step():
+            start = time.perf_counter()
+            envs.step(actions)
+            return time.perf_counter() - start
+
+        return step
+
+    nvec = envs.action_plane_space.nvec
+    if config["env_class"] == "pettingzoo":
+        state = {"masks": envs.get_action_mask()}
+
+        def step():
+            elapsed = 0
+            for i, agent in enumerate(envs.agents):
+                action = sample_actions(state["masks"][i], nvec)
+                start = time.perf_counter()
+                envs.step(action)
+                elapsed += time.perf_counter() - start
+            if any(envs.dones.values()):
+                envs.reset()
+                state["masks"] = envs.get_action_mask()
+            else:
+                state["masks"] = np.stack([envs.observations[agent]["action_masks"] for agent in envs.agents])
+            return elapsed
+
+        return step
+
+    state = {"masks": envs.get_action_mask()}
+
+    def step():
+        actions = sample_actions(state["masks"], nvec).reshape(num_envs, -1)
+        start = time.perf_counter()
+        _, _, _, _, state["masks"] = envs.step_with_masks(actions)
+        return time.perf_counter() - start
+
+    return step
+
+
+def run(config, num_steps, num_warmup_steps):
+    start = time.perf_counter()
+    envs = make_envs(config)
+    envs.reset()
+    startup_time = time.perf_counter() - start
+    step = step_fn(envs, config)
+    for _ in range(num_warmup_steps):
+        step()
+    latencies = np.array([step() for _ in range(num_steps)])
+    result = dict(
+        config,
+        startup_s=startup_time,
+        sps=num_steps * config["num_envs"] / latencies.sum(),
+        latency_ms={f"p{q}": np.percentile(latencies, q) * 1000 for q in [50, 90, 99]},
+        rss_mb=rss_mb(),
+    )
+    result["latency_ms"]["max"] = latencies.max() * 1000
+    envs.close()
+    return result
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.run is not None:
+        config, result_path = json.loads(args.run)
+        with open(result_path, "w") as f:
+            json.dump(run(config, args.num_steps, args.num_warmup_steps), f)
+        sys.exit(0)
+
+    configs = [
+        dict(env_class=env_class, num_envs=num_envs, map_path=map_path, ai=ai)
+        for env_class in args.env_classes
+        for num_envs in args.num_envs
+        for map_path in args.maps
+        for ai in args.ais
+    ]
+    results = []
+    print(f"{'env':>10} {'envs':>5} {'map':>34} {'ai':>15} {'SPS':>8} {'p50 ms':>8} {'p99 ms':>8} {'rss MB':>7}")
+    for config in configs:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result_path = os.path.join(tmpdir, "result.json")
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--run",
+                    json.dumps([config, result_path]),
+                    "--num-steps",
+                    str(args.num_steps),
+                    "--num-warmup-steps",
+                    str(args.num_warmup_steps),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            if process.returncode != 0:
+                # e.g. a bot that is not bundled, the other configs still run
+                results.append(dict(config, error=(process.stderr.strip().splitlines() or [""])[-1]))
+                print(f"{config['env_class']:>10} {config['num_envs']:>5} {config['map_path']:>34} {config['ai']:>15} failed")
+                continue
+            with open(result_path) as f:
+                result = json.load(f)
+        results.append(result)
+        print(
+            f"{result['env_class']:>10} {result['num_envs']:>5} {result['map_path']:>34} {result['ai']:>15} "
+            f"{result['sps']:>8.0f} {result['latency_ms']['p50']:>8.2f} {result['latency_ms']['p99']:>8.2f} {result['rss_mb']:>7.0f}"
+        )
+
+    with open(args.output_path, "w") as f:
+        json.dump(
+            dict(
+                gym_microrts_version=gym_microrts.__version__,
+                python=platform.python_version(),
+                platform=platform.platform(),
+                cpu_count=os.cpu_count(),
+                num_steps=args.num_steps,
+                results=results,
+            ),
+            f,
+            indent=2,
+        )
+    print(f"results written to {args.output_path}")
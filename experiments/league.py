@@ -58,7 +58,7 @@ def parse_args():
         help='the highest sigma of the trueskill evaluation')
     parser.add_argument('--output-path', type=str, default=f"league.temp.csv",
         help='the output path of the leaderboard csv')
-    parser.add_argument('--model-type', type=str, default=f"ppo_gridnet_large", choices=["ppo_gridnet_large", "ppo_gridnet"],
+    parser.add_argument('--model-type', type=str, default=f"ppo_gridnet_large", choices=["ppo_gridnet_large", "ppo_gridnet", "ppo_gridnet_sparse"],
         help='the output path of the leaderboard csv')
     parser.add_argument('--maps', nargs='+', default=["maps/16x16/basesWorkers16x16A.xml"],
         help="the maps to do trueskill evaluations")
@@ -86,6 +86,11 @@ db = SqliteDatabase(dbpath)
 if args.model_type == "ppo_gridnet_large":
     from ppo_gridnet_large import Agent, MicroRTSStatsRecorder
 
+    from gym_microrts.envs.vec_env import MicroRTSBotVecEnv, MicroRTSGridModeVecEnv
+elif args.model_type == "ppo_gridnet_sparse":
+    from ppo_gridnet import MicroRTSStatsRecorder
+    from ppo_gridnet import SparseAgent as Agent
+
     from gym_microrts.envs.vec_env import MicroRTSBotVecEnv, MicroRTSGridModeVecEnv
 else:
     from ppo_gridnet import Agent, MicroRTSStatsRecorder
@@ -385,6 +390,8 @@ if __name__ == "__main__":
                     defender = AI.get_or_none(name=m.p1)
 
                     r = m.run(args.num_matches // 2)
+                    # release the game clients, the next match reuses the JVM
+                    m.envs.close()
                     for item in r:
                         drawn = False
                         if item == Outcome.WIN.value:
@@ -453,6 +460,8 @@ if __name__ == "__main__":
                         defender = AI.get_or_none(name=m.p1)
 
                         r = m.run(1)
+                        # release the game clients, the next match reuses the JVM
+                        m.envs.close()
                         for item in r:
                             drawn = False
                             if item == Outcome.WIN.value:
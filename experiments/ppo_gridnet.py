@@ -15,11 +15,11 @@ import torch.nn as nn
 import torch.optim as optim
 from gym.spaces import MultiDiscrete
 from stable_baselines3.common.vec_env import VecEnvWrapper, VecMonitor, VecVideoRecorder
-from torch.distributions.categorical import Categorical
 from torch.utils.tensorboard import SummaryWriter
 
-from gym_microrts import microrts_ai
+from gym_microrts import masked_multi_categorical, microrts_ai
 from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
+from gym_microrts.torch_utils import compute_gae, compute_returns, unpack_action_mask
 
 
 def parse_args():
@@ -95,6 +95,8 @@ def parse_args():
         help='the list of maps used during training')
     parser.add_argument('--eval-maps', nargs='+', default=["maps/16x16/basesWorkers16x16A.xml"],
         help='the list of maps used during evaluation')
+    parser.add_argument('--sparse-head', type=lambda x: bool(strtobool(x)), default=False, nargs='?', const=True,
+        help='if toggled, the actor only computes the actions of the cells whose unit can act (`SparseAgent`)')
 
     args = parser.parse_args()
     if not args.seed:
@@ -146,12 +148,6 @@ class MicroRTSStatsRecorder(VecEnvWrapper):
 
 
 # ALGO LOGIC: initialize agent here:
-class CategoricalMasked(Categorical):
-    def __init__(self, probs=None, logits=None, validate_args=None, masks=[], mask_value=None):
-        logits = torch.where(masks.bool(), logits, mask_value)
-        super(CategoricalMasked, self).__init__(probs, logits, validate_args)
-
-
 class Transpose(nn.Module):
     def __init__(self, permutation):
         super().__init__()
@@ -200,37 +196,123 @@ class Agent(nn.Module):
         hidden = self.encoder(x)
         logits = self.actor(hidden)
         grid_logits = logits.reshape(-1, envs.action_plane_space.nvec.sum())
-        split_logits = torch.split(grid_logits, envs.action_plane_space.nvec.tolist(), dim=1)
-
-        if action is None:
-            invalid_action_masks = invalid_action_masks.view(-1, invalid_action_masks.shape[-1])
-            split_invalid_action_masks = torch.split(invalid_action_masks, envs.action_plane_space.nvec.tolist(), dim=1)
-            multi_categoricals = [
-                CategoricalMasked(logits=logits, masks=iam, mask_value=self.mask_value)
-                for (logits, iam) in zip(split_logits, split_invalid_action_masks)
-            ]
-            action = torch.stack([categorical.sample() for categorical in multi_categoricals])
-        else:
-            invalid_action_masks = invalid_action_masks.view(-1, invalid_action_masks.shape[-1])
-            action = action.view(-1, action.shape[-1]).T
-            split_invalid_action_masks = torch.split(invalid_action_masks, envs.action_plane_space.nvec.tolist(), dim=1)
-            multi_categoricals = [
-                CategoricalMasked(logits=logits, masks=iam, mask_value=self.mask_value)
-                for (logits, iam) in zip(split_logits, split_invalid_action_masks)
-            ]
-        logprob = torch.stack([categorical.log_prob(a) for a, categorical in zip(action, multi_categoricals)])
-        entropy = torch.stack([categorical.entropy() for categorical in multi_categoricals])
+        invalid_action_masks = invalid_action_masks.view(-1, invalid_action_masks.shape[-1])
+        if action is not None:
+            action = action.view(-1, action.shape[-1])
+        action, logprob, entropy = masked_multi_categorical(
+            grid_logits, invalid_action_masks, envs.action_plane_space.nvec.tolist(), action, self.mask_value
+        )
         num_predicted_parameters = len(envs.action_plane_space.nvec)
-        logprob = logprob.T.view(-1, self.mapsize, num_predicted_parameters)
-        entropy = entropy.T.view(-1, self.mapsize, num_predicted_parameters)
-        action = action.T.view(-1, self.mapsize, num_predicted_parameters)
-        return action, logprob.sum(1).sum(1), entropy.sum(1).sum(1), invalid_action_masks, self.critic(hidden)
+        action = action.view(-1, self.mapsize, num_predicted_parameters)
+        logprob = logprob.view(-1, self.mapsize).sum(1)
+        entropy = entropy.view(-1, self.mapsize).sum(1)
+        return action, logprob, entropy, invalid_action_masks, self.critic(hidden)
 
     def get_value(self, x):
         return self.critic(self.encoder(x))
 
 
-def run_evaluation(model_path: str, output_path: str, eval_maps: List[str]):
+class SparseAgent(Agent):
+    """
+    Same as `Agent`, but the actor only computes the logits of the cells whose unit can act, from the
+    encoder features of the cell's region and the cell's observation. Its cost scales with the number
+    of units rather than the map area, and the other cells take NOOP actions.
+    """
+
+    def __init__(self, envs, mapsize=16 * 16):
+        super(SparseAgent, self).__init__(envs, mapsize)
+        h, w, c = envs.observation_space.shape
+        self.actor = nn.Sequential(
+            layer_init(nn.Linear(64 + c, 128)),
+            nn.ReLU(),
+            layer_init(nn.Linear(128, envs.action_plane_space.nvec.sum()), std=0.01),
+        )
+        # the encoder downsamples the map 4 times, the index of each cell in its flattened features
+        ys, xs = np.divmod(np.arange(h * w), w)
+        self.register_buffer("hidden_idxs", torch.tensor((ys // 4) * ((w + 3) // 4) + xs // 4), persistent=False)
+
+    def get_action_and_value(self, x, action=None, invalid_action_masks=None, envs=None, device=None):
+        hidden = self.encoder(x)
+        num_predicted_parameters = len(envs.action_plane_space.nvec)
+        invalid_action_masks = invalid_action_masks.view(-1, invalid_action_masks.shape[-1])
+        cell_masks = invalid_action_masks.view(len(x), self.mapsize, -1)
+        # the cells of the units that can act, whose NOOP action type is valid
+        env_idxs, cell_idxs = cell_masks[:, :, 0].nonzero(as_tuple=True)
+        cell_hidden = hidden.flatten(2)[env_idxs, :, self.hidden_idxs[cell_idxs]]
+        cell_obs = x.reshape(len(x), self.mapsize, -1)[env_idxs, cell_idxs]
+        cell_logits = self.actor(torch.cat([cell_hidden, cell_obs], dim=1))
+        if action is not None:
+            action = action.view(len(x), self.mapsize, -1)[env_idxs, cell_idxs]
+        cell_action, cell_logprob, cell_entropy = masked_multi_categorical(
+            cell_logits, cell_masks[env_idxs, cell_idxs], envs.action_plane_space.nvec.tolist(), action, self.mask_value
+        )
+        # as with `Agent`, the cells without units add nothing to the log-probs and entropies
+        action = cell_action.new_zeros((len(x), self.mapsize, num_predicted_parameters))
+        action[env_idxs, cell_idxs] = cell_action
+        logprob = cell_logprob.new_zeros(len(x)).index_add_(0, env_idxs, cell_logprob)
+        entropy = cell_entropy.new_zeros(len(x)).index_add_(0, env_idxs, cell_entropy)
+        return action, logprob, entropy, invalid_action_masks, self.critic(hidden)
+
+
+class RolloutBuffer:
+    """
+    The observations, actions and action masks of a rollout, stored compactly in host memory (pinned
+    when training on GPU): the observations and actions as uint8 and the masks bit-packed, instead
+    of float32 tensors on the device. They are copied to the device without blocking and expanded
+    there, one step during the rollout and one minibatch during the updates.
+    """
+
+    def __init__(self, num_steps, num_envs, obs_shape, action_shape, num_mask_bits, device):
+        self.device = device
+        self.num_mask_bits = num_mask_bits
+        self.pin_memory = device.type == "cuda"
+        self.obs = torch.zeros((num_steps, num_envs) + obs_shape, dtype=torch.uint8, pin_memory=self.pin_memory)
+        self.actions = torch.zeros((num_steps, num_envs) + action_shape, dtype=torch.uint8, pin_memory=self.pin_memory)
+        self.masks = torch.zeros(
+            (num_steps, num_envs, action_shape[0], (num_mask_bits + 7) // 8), dtype=torch.uint8, pin_memory=self.pin_memory
+        )
+        # the pinned buffers the minibatches are gathered into, and the copies out of them in flight
+        self.staging = {}
+        self.copy_events = {}
+
+    def add(self, step, obs, packed_masks):
+        """
+        Store the observations and the packed action masks (`envs.get_packed_action_mask()`) of a step.
+        :return: (float observations, bool action masks) on the device
+        """
+        self.obs[step] = torch.from_numpy(obs)
+        self.masks[step] = torch.from_numpy(packed_masks)
+        obs = self.obs[step].to(self.device, non_blocking=True).float()
+        masks = unpack_action_mask(self.masks[step].to(self.device, non_blocking=True), self.num_mask_bits)
+        return obs, masks
+
+    def minibatch(self, inds):
+        """
+        :param inds: indices into the flattened (step, env) batch
+        :return: (float observations, long actions, bool action masks) of the minibatch on the device
+        """
+        inds = torch.as_tensor(inds)
+        obs = self._gather("obs", self.obs, inds).float()
+        actions = self._gather("actions", self.actions, inds).long()
+        masks = unpack_action_mask(self._gather("masks", self.masks, inds), self.num_mask_bits)
+        return obs, actions, masks
+
+    def _gather(self, name, storage, inds):
+        storage = storage.view((-1,) + storage.shape[2:])
+        if name not in self.staging or len(self.staging[name]) != len(inds):
+            self.staging[name] = torch.empty((len(inds),) + storage.shape[1:], dtype=storage.dtype, pin_memory=self.pin_memory)
+        if name in self.copy_events:
+            # the previous minibatch may still be copied out of the staging buffer
+            self.copy_events.pop(name).synchronize()
+        torch.index_select(storage, 0, inds, out=self.staging[name])
+        out = self.staging[name].to(self.device, non_blocking=True)
+        if self.pin_memory:
+            self.copy_events[name] = torch.cuda.Event()
+            self.copy_events[name].record()
+        return out
+
+
+def run_evaluation(model_path: str, output_path: str, eval_maps: List[str], model_type: str = "ppo_gridnet"):
     args = [
         "python",
         "league.py",
@@ -243,7 +325,7 @@ def run_evaluation(model_path: str, output_path: str, eval_maps: List[str]):
         "--output-path",
         output_path,
         "--model-type",
-        "ppo_gridnet",
+        model_type,
         "--maps",
         *eval_maps,
     ]
@@ -341,6 +423,7 @@ if __name__ == "__main__":
         map_paths=[args.train_maps[0]],
         reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
         cycle_maps=args.train_maps,
+        obs_dtype=np.uint8,
     )
     envs = MicroRTSStatsRecorder(envs, args.gamma)
     envs = VecMonitor(envs)
@@ -356,7 +439,7 @@ if __name__ == "__main__":
 
         eval_executor = ThreadPoolExecutor(max_workers=args.max_eval_workers, thread_name_prefix="league-eval-")
 
-    agent = Agent(envs).to(device)
+    agent = (SparseAgent if args.sparse_head else Agent)(envs).to(device)
     optimizer = optim.Adam(agent.parameters(), lr=args.learning_rate, eps=1e-5)
     if args.anneal_lr:
         # https://github.com/openai/baselines/blob/ea25b9e8b234e6ee1bca43083f8f3cf974143998/baselines/ppo2/defaults.py#L20
@@ -365,21 +448,25 @@ if __name__ == "__main__":
     # ALGO Logic: Storage for epoch data
     mapsize = 16 * 16
     action_space_shape = (mapsize, len(envs.action_plane_space.nvec))
-    invalid_action_shape = (mapsize, envs.action_plane_space.nvec.sum())
 
-    obs = torch.zeros((args.num_steps, args.num_envs) + envs.observation_space.shape).to(device)
-    actions = torch.zeros((args.num_steps, args.num_envs) + action_space_shape).to(device)
+    rollout = RolloutBuffer(
+        args.num_steps,
+        args.num_envs,
+        envs.observation_space.shape,
+        action_space_shape,
+        int(envs.action_plane_space.nvec.sum()),
+        device,
+    )
     logprobs = torch.zeros((args.num_steps, args.num_envs)).to(device)
     rewards = torch.zeros((args.num_steps, args.num_envs)).to(device)
     dones = torch.zeros((args.num_steps, args.num_envs)).to(device)
     values = torch.zeros((args.num_steps, args.num_envs)).to(device)
-    invalid_action_masks = torch.zeros((args.num_steps, args.num_envs) + invalid_action_shape).to(device)
     # TRY NOT TO MODIFY: start the game
     global_step = 0
     start_time = time.time()
     # Note how `next_obs` and `next_done` are used; their usage is equivalent to
     # https://github.com/ikostrikov/pytorch-a2c-ppo-acktr-gail/blob/84a7582477fb0d5c82ad6d850fe476829dddd2e1/a2c_ppo_acktr/storage.py#L60
-    next_obs = torch.Tensor(envs.reset()).to(device)
+    next_obs = envs.reset()
     next_done = torch.zeros(args.num_envs).to(device)
 
     # CRASH AND RESUME LOGIC:
@@ -418,21 +505,20 @@ if __name__ == "__main__":
         for step in range(0, args.num_steps):
             # envs.render()
             global_step += 1 * args.num_envs
-            obs[step] = next_obs
+            step_obs, step_masks = rollout.add(step, next_obs, envs.get_packed_action_mask())
             dones[step] = next_done
             # ALGO LOGIC: put action logic here
             with torch.no_grad():
-                invalid_action_masks[step] = torch.tensor(envs.get_action_mask()).to(device)
                 action, logproba, _, _, vs = agent.get_action_and_value(
-                    next_obs, envs=envs, invalid_action_masks=invalid_action_masks[step], device=device
+                    step_obs, envs=envs, invalid_action_masks=step_masks, device=device
                 )
                 values[step] = vs.flatten()
 
-            actions[step] = action
+            action = action.cpu()
+            rollout.actions[step] = action
             logprobs[step] = logproba
             try:
-                next_obs, rs, ds, infos = envs.step(action.cpu().numpy().reshape(envs.num_envs, -1))
-                next_obs = torch.Tensor(next_obs).to(device)
+                next_obs, rs, ds, infos = envs.step(action.numpy().reshape(envs.num_envs, -1))
             except Exception as e:
                 e.printStackTrace()
                 raise
@@ -449,40 +535,17 @@ if __name__ == "__main__":
 
         # bootstrap reward if not done. reached the batch limit
         with torch.no_grad():
-            last_value = agent.get_value(next_obs).reshape(1, -1)
+            last_value = agent.get_value(torch.from_numpy(next_obs).to(device).float()).reshape(1, -1)
             if args.gae:
-                advantages = torch.zeros_like(rewards).to(device)
-                lastgaelam = 0
-                for t in reversed(range(args.num_steps)):
-                    if t == args.num_steps - 1:
-                        nextnonterminal = 1.0 - next_done
-                        nextvalues = last_value
-                    else:
-                        nextnonterminal = 1.0 - dones[t + 1]
-                        nextvalues = values[t + 1]
-                    delta = rewards[t] + args.gamma * nextvalues * nextnonterminal - values[t]
-                    advantages[t] = lastgaelam = delta + args.gamma * args.gae_lambda * nextnonterminal * lastgaelam
-                returns = advantages + values
+                advantages, returns = compute_gae(rewards, values, dones, last_value, next_done, args.gamma, args.gae_lambda)
             else:
-                returns = torch.zeros_like(rewards).to(device)
-                for t in reversed(range(args.num_steps)):
-                    if t == args.num_steps - 1:
-                        nextnonterminal = 1.0 - next_done
-                        next_return = last_value
-                    else:
-                        nextnonterminal = 1.0 - dones[t + 1]
-                        next_return = returns[t + 1]
-                    returns[t] = rewards[t] + args.gamma * nextnonterminal * next_return
-                advantages = returns - values
-
-        # flatten the batch
-        b_obs = obs.reshape((-1,) + envs.observation_space.shape)
+                advantages, returns = compute_returns(rewards, values, dones, last_value, next_done, args.gamma)
+
+        # flatten the batch, the observations, actions and masks are gathered per minibatch by `rollout`
         b_logprobs = logprobs.reshape(-1)
-        b_actions = actions.reshape((-1,) + action_space_shape)
         b_advantages = advantages.reshape(-1)
         b_returns = returns.reshape(-1)
         b_values = values.reshape(-1)
-        b_invalid_action_masks = invalid_action_masks.reshape((-1,) + invalid_action_shape)
 
         # Optimizing the policy and value network
         inds = np.arange(
@@ -496,8 +559,9 @@ if __name__ == "__main__":
                 mb_advantages = b_advantages[minibatch_ind]
                 if args.norm_adv:
                     mb_advantages = (mb_advantages - mb_advantages.mean()) / (mb_advantages.std() + 1e-8)
+                mb_obs, mb_actions, mb_invalid_action_masks = rollout.minibatch(minibatch_ind)
                 _, newlogproba, entropy, _, new_values = agent.get_action_and_value(
-                    b_obs[minibatch_ind], b_actions.long()[minibatch_ind], b_invalid_action_masks[minibatch_ind], envs, device
+                    mb_obs, mb_actions, mb_invalid_action_masks, envs, device
                 )
                 ratio = (newlogproba - b_logprobs[minibatch_ind]).exp()
 
@@ -543,6 +607,7 @@ if __name__ == "__main__":
                     f"models/{experiment_name}/{global_step}.pt",
                     f"runs/{experiment_name}/{global_step}.csv",
                     args.eval_maps,
+                    "ppo_gridnet_sparse" if args.sparse_head else "ppo_gridnet",
                 )
                 print(f"Queued models/{experiment_name}/{global_step}.pt")
                 future.add_done_callback(trueskill_writer.on_evaluation_done)
@@ -52,7 +52,7 @@ def parse_args():
         help="the path to the agent's model")
     parser.add_argument('--ai', type=str, default="",
         help='the opponent AI to evaluate against')
-    parser.add_argument('--model-type', type=str, default=f"ppo_gridnet", choices=["ppo_gridnet_large", "ppo_gridnet"],
+    parser.add_argument('--model-type', type=str, default=f"ppo_gridnet", choices=["ppo_gridnet_large", "ppo_gridnet", "ppo_gridnet_sparse"],
         help='the output path of the leaderboard csv')
     args = parser.parse_args()
     if not args.seed:
@@ -74,6 +74,11 @@ if __name__ == "__main__":
     if args.model_type == "ppo_gridnet_large":
         from ppo_gridnet_large import Agent, MicroRTSStatsRecorder
 
+        from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
+    elif args.model_type == "ppo_gridnet_sparse":
+        from ppo_gridnet import MicroRTSStatsRecorder
+        from ppo_gridnet import SparseAgent as Agent
+
         from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
     else:
         from ppo_gridnet import Agent, MicroRTSStatsRecorder
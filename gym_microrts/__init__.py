@@ -1 +1,10 @@
 __version__ = "0.0.0"
+
+
+def __getattr__(name):
+    # the torch helpers are imported on first use, as torch is not a dependency of the envs
+    if name == "masked_multi_categorical":
+        from gym_microrts.torch_utils import masked_multi_categorical
+
+        return masked_multi_categorical
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
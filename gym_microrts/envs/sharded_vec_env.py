@@ -0,0 +1,338 @@
+import multiprocessing as mp
+import multiprocessing.connection
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from gym_microrts.envs.vec_env import MicroRTSGridModeSharedMemVecEnv, split_games
+
+
+def _attach_shared_arrays(specs, start, stop):
+    """
+    Attach to the shared memory blocks created by the parent process.
+    :param specs: list of (key, shared memory name, shape, dtype)
+    :param start, stop: the slice of envs owned by the caller
+    :return: (shared memory blocks, dict of key -> the [start:stop] slice of the array)
+    """
+    blocks, arrays = [], {}
+    for key, name, shape, dtype in specs:
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            # the parent owns (and unlinks) the blocks, keep the resource tracker from doing it twice
+            from multiprocessing import resource_tracker
+
+            resource_tracker.unregister(block._name, "shared_memory")
+        except Exception:
+            pass
+        blocks.append(block)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)[start:stop]
+    return blocks, arrays
+
+
+def _worker(remote, parent_remote, start, stop, env_kwargs):
+    parent_remote.close()
+    envs = MicroRTSGridModeSharedMemVecEnv(**env_kwargs)
+    blocks, arrays = [], {}
+    try:
+        remote.send(
+            (
+                envs.observation_space,
+                envs.action_space,
+                envs.action_plane_space,
+                envs.action_space_dims,
+                len(envs.rfs),
+            )
+        )
+        blocks, arrays = _attach_shared_arrays(remote.recv(), start, stop)
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                obs, reward, done, infos = envs.step(arrays["actions"])
+                np.copyto(arrays["obs"], obs)
+                np.copyto(arrays["reward"], reward)
+                np.copyto(arrays["done"], done)
+                np.copyto(arrays["raw_rewards"], np.stack([info["raw_rewards"] for info in infos]))
+                if data:
+                    np.copyto(arrays["action_mask"], envs.get_action_mask())
+                remote.send(None)
+            elif cmd == "reset":
+                np.copyto(arrays["obs"], envs.reset())
+                arrays["reward"].fill(0)
+                arrays["done"].fill(False)
+                arrays["raw_rewards"].fill(0)
+                if data:
+                    np.copyto(arrays["action_mask"], envs.get_action_mask())
+                remote.send(None)
+            elif cmd == "get_action_mask":
+                np.copyto(arrays["action_mask"], envs.get_action_mask())
+                remote.send(None)
+            elif cmd == "close":
+                remote.close()
+                break
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+    except KeyboardInterrupt:
+        print("MicroRTSGridModeShardedVecEnv worker: got KeyboardInterrupt")
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+        envs.close()
+
+
+class MicroRTSGridModeShardedVecEnv:
+    """
+    Splits the games of a `MicroRTSGridModeSharedMemVecEnv` across `num_shards` worker
+    processes, each running its own JVM (JPype allows only one per process). The workers
+    write observations, action masks and rewards into `multiprocessing.shared_memory`
+    blocks, so the parent reads them as one contiguous batch without copies over pipes.
+
+    The envs keep the order of `MicroRTSGridModeSharedMemVecEnv`: selfplay pairs first,
+    then bot envs. Every shard owns a contiguous slice of that order, and a selfplay pair
+    never straddles two shards. The returned arrays are views of the shared blocks and
+    are overwritten by the next call. Requires Python 3.8+ (`multiprocessing.shared_memory`).
+
+    Besides the synchronous `step`, the shards can be stepped asynchronously, EnvPool-style:
+    `send(actions, env_ids)` starts stepping the shards owning `env_ids` and `recv()` returns
+    the results of the shards that are done, so that the policy can act on the games of fast
+    bots while slow ones (e.g. `coacAI`, `naiveMCTSAI`) are still thinking. The async mode works
+    at the granularity of shards, pass `num_shards` equal to the number of games for per-game
+    scheduling.
+
+    :param num_shards: the number of worker processes
+    :param start_method: the multiprocessing start method, defaults to `forkserver`
+        (or `spawn` where unavailable) so that no JVM state is ever forked
+    The remaining parameters are the ones of `MicroRTSGridModeSharedMemVecEnv`; `ai2s` and
+    `map_paths` are given for all envs and split across the shards.
+    """
+
+    def __init__(
+        self,
+        num_selfplay_envs,
+        num_bot_envs,
+        num_shards=2,
+        partial_obs=False,
+        max_steps=2000,
+        render_theme=2,
+        frame_skip=0,
+        ai2s=[],
+        map_paths=["maps/10x10/basesTwoWorkers10x10.xml"],
+        reward_weight=np.array([0.0, 1.0, 0.0, 0.0, 0.0, 5.0]),
+        cycle_maps=[],
+        obs_mode="one_hot",
+        start_method=None,
+    ):
+        self.num_selfplay_envs = num_selfplay_envs
+        self.num_bot_envs = num_bot_envs
+        self.num_envs = num_selfplay_envs + num_bot_envs
+        assert self.num_bot_envs == len(ai2s), "for each environment, a microrts ai should be provided"
+        assert self.num_selfplay_envs % 2 == 0, "selfplay envs come in pairs"
+        if len(map_paths) == 1:
+            map_paths = [map_paths[0] for _ in range(self.num_envs)]
+        else:
+            assert (
+                len(map_paths) == self.num_envs
+            ), "if multiple maps are provided, they should be provided for each environment"
+        self.reward_weight = reward_weight
+        self.closed = True
+
+        # split the games (a selfplay pair or a bot env) into contiguous shards
+        self.num_shards = num_shards
+        self.shard_slices = split_games(num_selfplay_envs, num_bot_envs, num_shards)
+
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_shards)])
+        self.processes = []
+        for work_remote, remote, (start, stop) in zip(self.work_remotes, self.remotes, self.shard_slices):
+            # `ai2s` is indexed by bot env, which come after the selfplay envs
+            bot_start, bot_stop = (
+                max(start, num_selfplay_envs) - num_selfplay_envs,
+                max(stop, num_selfplay_envs) - num_selfplay_envs,
+            )
+            env_kwargs = dict(
+                num_selfplay_envs=stop - start - (bot_stop - bot_start),
+                num_bot_envs=bot_stop - bot_start,
+                partial_obs=partial_obs,
+                max_steps=max_steps,
+                render_theme=render_theme,
+                frame_skip=frame_skip,
+                ai2s=ai2s[bot_start:bot_stop],
+                map_paths=map_paths[start:stop],
+                reward_weight=reward_weight,
+                cycle_maps=cycle_maps,
+                obs_mode=obs_mode,
+            )
+            process = ctx.Process(target=_worker, args=(work_remote, remote, start, stop, env_kwargs), daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+        self.closed = False
+
+        shard_specs = [remote.recv() for remote in self.remotes]
+        (
+            self.observation_space,
+            self.action_space,
+            self.action_plane_space,
+            self.action_space_dims,
+            num_raw_rewards,
+        ) = shard_specs[0]
+        if any(spec[0] != self.observation_space for spec in shard_specs[1:]):
+            self.close()
+            raise ValueError("all shards should have the same observation space, maps of different sizes were given")
+        self.height, self.width = self.observation_space.shape[:2]
+
+        # allocate the shared memory blocks seen by the workers
+        self.shared_blocks = []
+        self.shared_arrays = {}
+        specs = []
+        for key, shape, dtype in [
+            ("obs", (self.num_envs,) + self.observation_space.shape, self.observation_space.dtype),
+            ("action_mask", (self.num_envs, self.height * self.width, sum(self.action_space_dims)), np.int32),
+            ("actions", (self.num_envs, self.height * self.width, len(self.action_space_dims)), np.int32),
+            ("reward", (self.num_envs,), np.float64),
+            ("done", (self.num_envs,), np.bool_),
+            ("raw_rewards", (self.num_envs, num_raw_rewards), np.float64),
+        ]:
+            dtype = np.dtype(dtype)
+            block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+            self.shared_blocks.append(block)
+            self.shared_arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            specs.append((key, block.name, shape, dtype.str))
+        for remote in self.remotes:
+            remote.send(specs)
+
+        # the shards of the async mode that have been sent a command and not been received yet
+        self.shard_env_ids = [np.arange(start, stop) for start, stop in self.shard_slices]
+        self.env_shards = np.concatenate([np.full(stop - start, i) for i, (start, stop) in enumerate(self.shard_slices)])
+        self.pending_shards = set()
+
+    def _check_no_pending_shards(self):
+        # a synchronous command sent to a pending shard would read back the reply of its `send`
+        if len(self.pending_shards) > 0:
+            raise RuntimeError(f"shards {sorted(self.pending_shards)} have not been received yet, call `recv` first")
+
+    def _call(self, cmd, data=None):
+        self._check_no_pending_shards()
+        for remote in self.remotes:
+            remote.send((cmd, data))
+        for remote in self.remotes:
+            remote.recv()
+
+    def reset(self):
+        self._call("reset", False)
+        return self.shared_arrays["obs"]
+
+    def reset_with_masks(self):
+        """
+        Same as `reset`, but also returns the action masks of the first observation.
+        :return: (obs, action masks)
+        """
+        self._call("reset", True)
+        return self.shared_arrays["obs"], self.shared_arrays["action_mask"]
+
+    def step_async(self, actions, with_masks=False):
+        self._check_no_pending_shards()
+        np.copyto(self.shared_arrays["actions"], actions.reshape(self.shared_arrays["actions"].shape))
+        for remote in self.remotes:
+            remote.send(("step", with_masks))
+
+    def step_wait(self):
+        self._check_no_pending_shards()
+        for remote in self.remotes:
+            remote.recv()
+        # the info dicts are kept by callers, so their raw rewards are copied out of the shared block
+        infos = [{"raw_rewards": item} for item in self.shared_arrays["raw_rewards"].copy()]
+        return self.shared_arrays["obs"], self.shared_arrays["reward"], self.shared_arrays["done"], infos
+
+    def step(self, ac):
+        self.step_async(ac)
+        return self.step_wait()
+
+    def step_with_masks(self, ac):
+        """
+        Same as `step`, but the workers also write the action masks of the next observation
+        in the same round trip.
+        :return: (obs, reward, done, infos, action masks)
+        """
+        self.step_async(ac, with_masks=True)
+        return self.step_wait() + (self.shared_arrays["action_mask"],)
+
+    def get_action_mask(self):
+        """
+        :return: Mask for action types and action parameters,
+        of shape [num_envs, map height * width, action types + params].
+        """
+        self._call("get_action_mask")
+        return self.shared_arrays["action_mask"]
+
+    def async_reset(self):
+        """
+        Starts resetting all the envs, their first observations are returned by `recv`.
+        """
+        self._check_no_pending_shards()
+        for shard, remote in enumerate(self.remotes):
+            remote.send(("reset", True))
+            self.pending_shards.add(shard)
+
+    def send(self, actions, env_ids=None):
+        """
+        Starts stepping the envs `env_ids` without waiting for them.
+        :param actions: the actions of the envs `env_ids`, of shape [len(env_ids), map height * width * 7]
+        :param env_ids: the envs to step, which should make up whole shards (see `shard_slices`).
+            Defaults to all the envs.
+        """
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids)
+        shards = [int(shard) for shard in np.unique(self.env_shards[env_ids])]
+        if not np.array_equal(np.sort(env_ids), np.concatenate([self.shard_env_ids[shard] for shard in shards])):
+            raise ValueError(f"env_ids should make up whole shards {self.shard_slices}, got {env_ids}")
+        if not self.pending_shards.isdisjoint(shards):
+            raise RuntimeError(f"shards {sorted(self.pending_shards.intersection(shards))} have not been received yet")
+        self.shared_arrays["actions"][env_ids] = actions.reshape((len(env_ids),) + self.shared_arrays["actions"].shape[1:])
+        for shard in shards:
+            self.remotes[shard].send(("step", True))
+            self.pending_shards.add(shard)
+
+    def recv(self):
+        """
+        Waits until at least one of the shards sent to is done, and collects every shard that is done.
+        The results are copied out of the shared blocks, which the other shards keep writing to.
+        :return: (obs, reward, done, infos, action masks, env_ids) of the envs of the ready shards
+        """
+        if len(self.pending_shards) == 0:
+            raise RuntimeError("no shard has been sent a command, call `send` or `async_reset` first")
+        ready = mp.connection.wait([self.remotes[shard] for shard in self.pending_shards])
+        shards = sorted(self.remotes.index(remote) for remote in ready)
+        for shard in shards:
+            self.remotes[shard].recv()
+            self.pending_shards.remove(shard)
+        env_ids = np.concatenate([self.shard_env_ids[shard] for shard in shards])
+        infos = [{"raw_rewards": item} for item in self.shared_arrays["raw_rewards"][env_ids]]
+        return (
+            self.shared_arrays["obs"][env_ids],
+            self.shared_arrays["reward"][env_ids],
+            self.shared_arrays["done"][env_ids],
+            infos,
+            self.shared_arrays["action_mask"][env_ids],
+            env_ids,
+        )
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.shared_arrays = {}
+        for block in getattr(self, "shared_blocks", []):
+            try:
+                block.close()
+            except BufferError:
+                pass  # views returned to the caller are still alive, the memory is freed with them
+            block.unlink()
+        self.closed = True
@@ -1,9 +1,11 @@
 import json
 import os
-import subprocess
 import sys
+import threading
+import time
 import warnings
-import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
 from itertools import cycle
 
 import gym
@@ -15,12 +17,19 @@ from jpype.types import JArray, JInt
 from PIL import Image
 
 import gym_microrts
+from gym_microrts import microrts_jfr
+from gym_microrts.microrts_build import build_microrts
+from gym_microrts.microrts_jvm import start_jvm
+from gym_microrts.microrts_maps import map_size
 
 MICRORTS_CLONE_MESSAGE = """
 WARNING: the repository does not include the microrts git submodule.
 Executing `git submodule update --init --recursive` to clone it now.
 """
 
+OBS_MODES = ("one_hot", "categorical")
+OBS_DTYPES = (np.dtype(np.int32), np.dtype(np.uint8), np.dtype(np.bool_))
+
 MICRORTS_MAC_OS_RENDER_MESSAGE = """
 gym-microrts render is not available on MacOS. See https://github.com/jpype-project/jpype/issues/906
 
@@ -30,6 +39,107 @@ as an example.
 """
 
 
+def split_games(num_selfplay_envs, num_bot_envs, num_splits):
+    """
+    Split the envs into contiguous slices of whole games (a selfplay pair or a bot env),
+    following the env order of the JNI clients: selfplay pairs first, then bot envs.
+    :return: list of `num_splits` (start, stop) env indices
+    """
+    game_sizes = [2] * (num_selfplay_envs // 2) + [1] * num_bot_envs
+    if not 0 < num_splits <= len(game_sizes):
+        raise ValueError(f"the envs can be split into 1 to {len(game_sizes)} (the number of games) slices, got {num_splits}")
+    slices, start = [], 0
+    for split_game_sizes in np.array_split(np.array(game_sizes), num_splits):
+        slices.append((start, start + int(split_game_sizes.sum())))
+        start += int(split_game_sizes.sum())
+    return slices
+
+
+def _concatenate(arrays):
+    return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+
+def to_java_actions(actions, source_unit_mask):
+    """
+    Pack the actions of the units that can act into the `int[num_envs][num_units][1 + 7]` array
+    expected by the JNI clients (see `to_java_unit_actions`).
+    :param actions: of shape [num_envs, map height * width, action types + params]
+    :param source_unit_mask: of shape [num_envs, map height * width]
+    """
+    env_idxs, source_unit_idxs = np.nonzero(source_unit_mask)
+    return to_java_unit_actions(env_idxs, source_unit_idxs, actions[env_idxs, source_unit_idxs], len(source_unit_mask))
+
+
+def to_java_unit_actions(env_idxs, source_unit_idxs, unit_actions, num_envs):
+    """
+    Pack the actions of the given units into the `int[num_envs][num_units][1 + 7]` array expected
+    by the JNI clients. The unit actions of all envs are gathered into one flat int32 buffer and
+    each env's slice is handed to the JVM in bulk, so the number of JPype calls depends on the
+    number of envs but not on the number of units.
+    :param env_idxs: the env of each unit, sorted
+    :param source_unit_idxs: the cell of each unit (`y * map width + x`)
+    :param unit_actions: of shape [num units, action types + params]
+    """
+    unit_actions_buffer = np.empty((len(source_unit_idxs), unit_actions.shape[-1] + 1), dtype=np.int32)
+    unit_actions_buffer[:, 0] = source_unit_idxs  # specify source unit
+    unit_actions_buffer[:, 1:] = unit_actions
+    action_offsets = np.zeros(num_envs + 1, dtype=np.int64)
+    np.cumsum(np.bincount(env_idxs, minlength=num_envs), out=action_offsets[1:])
+
+    java_actions = JArray(JArray(JArray(JInt)))(num_envs)
+    for i in range(num_envs):
+        start, end = action_offsets[i], action_offsets[i + 1]
+        java_actions[i] = JArray.of(unit_actions_buffer[start:end]) if end > start else JArray(JArray(JInt))(0)
+    return java_actions
+
+
+class PerfStats:
+    """
+    Call counts, cumulative and last wall-clock times of the phases of the env calls (see
+    `MicroRTSGridModeVecEnv.perf_stats`). Recording a phase costs about a microsecond (a
+    `time.perf_counter` call and a few dict updates under a lock), so it can stay enabled
+    in training runs. When disabled, `record` only reads the clock.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.calls, self.total, self.last = {}, {}, {}
+
+    def record(self, phase, start):
+        """
+        Records the time elapsed since `start`, a `time.perf_counter()` value, in `phase`.
+        Phases may be recorded from several threads (e.g. one per JNI client).
+        :return: the current `time.perf_counter()`, i.e. the start of the next phase
+        """
+        now = time.perf_counter()
+        if self.enabled:
+            elapsed = now - start
+            with self.lock:
+                self.calls[phase] = self.calls.get(phase, 0) + 1
+                self.total[phase] = self.total.get(phase, 0.0) + elapsed
+                self.last[phase] = elapsed
+        return now
+
+    def summary(self):
+        """
+        :return: {phase: {"calls", "total_s", "mean_ms", "last_ms"}}
+        """
+        with self.lock:
+            return {
+                phase: {
+                    "calls": self.calls[phase],
+                    "total_s": self.total[phase],
+                    "mean_ms": 1000 * self.total[phase] / self.calls[phase],
+                    "last_ms": 1000 * self.last[phase],
+                }
+                for phase in self.calls
+            }
+
+
 class MicroRTSGridModeVecEnv:
     metadata = {"render.modes": ["human", "rgb_array"], "video.frames_per_second": 150}
     """
@@ -54,6 +164,11 @@ class MicroRTSGridModeVecEnv:
         cycle_maps=[],
         autobuild=True,
         jvm_args=[],
+        obs_mode="one_hot",
+        obs_dtype=np.int32,
+        num_threads=1,
+        jvm_cds=False,
+        profile=False,
     ):
 
         self.num_selfplay_envs = num_selfplay_envs
@@ -73,53 +188,96 @@ class MicroRTSGridModeVecEnv:
                 len(map_paths) == self.num_envs
             ), "if multiple maps are provided, they should be provided for each environment"
         self.reward_weight = reward_weight
+        if obs_mode not in OBS_MODES:
+            raise ValueError(f"obs_mode should be one of {OBS_MODES}, got {obs_mode!r}")
+        self.obs_mode = obs_mode
+        if np.dtype(obs_dtype) not in OBS_DTYPES:
+            raise ValueError(f"obs_dtype should be one of {[str(dtype) for dtype in OBS_DTYPES]}, got {obs_dtype!r}")
+        self.obs_dtype = np.dtype(obs_dtype)
 
         self.microrts_path = os.path.join(gym_microrts.__path__[0], "microrts")
 
         # prepare training maps
         self.cycle_maps = list(map(lambda i: os.path.join(self.microrts_path, i), cycle_maps))
         self.next_map = cycle(self.cycle_maps)
+        # one env per game: the JVM orders the envs as selfplay pairs first, then bot envs
+        self.game_env_idxs = list(range(0, self.num_selfplay_envs, 2)) + list(range(self.num_selfplay_envs, self.num_envs))
+        # the games are split across `num_threads` JNI vec clients, stepped in parallel on a thread pool,
+        # which scales with the number of threads since JPype releases the GIL while the JVM runs
+        self.num_threads = num_threads
+        self.client_slices = split_games(self.num_selfplay_envs, self.num_bot_envs, num_threads)
+        self.thread_pool = ThreadPoolExecutor(max_workers=num_threads)
+        # the clients of the async mode (`send`/`recv`) that are stepping, with their futures
+        self.pending_clients = {}
+        self.perf = PerfStats(enabled=profile)
 
         if not os.path.exists(f"{self.microrts_path}/README.md"):
             print(MICRORTS_CLONE_MESSAGE)
             os.system(f"git submodule update --init --recursive")
 
         if autobuild:
-            print(f"removing {self.microrts_path}/microrts.jar...")
-            if os.path.exists(f"{self.microrts_path}/microrts.jar"):
-                os.remove(f"{self.microrts_path}/microrts.jar")
-            print(f"building {self.microrts_path}/microrts.jar...")
-            root_dir = os.path.dirname(gym_microrts.__path__[0])
-            print(root_dir)
-            subprocess.run(["bash", "build.sh", "&>", "build.log"], cwd=f"{root_dir}")
+            # only rebuilds the jar when the java sources or bot jars have changed
+            build_microrts(self.microrts_path)
 
         # read map
-        root = ET.parse(os.path.join(self.microrts_path, self.map_paths[0])).getroot()
-        self.height, self.width = int(root.get("height")), int(root.get("width"))
-
-        # launch the JVM
-        if not jpype._jpype.isStarted():
-            registerDomain("ts", alias="tests")
-            registerDomain("ai")
-            jars = [
-                "microrts.jar",
-                "lib/bots/Coac.jar",
-                "lib/bots/Droplet.jar",
-                "lib/bots/GRojoA3N.jar",
-                "lib/bots/Izanagi.jar",
-                "lib/bots/MixedBot.jar",
-                "lib/bots/TiamatBot.jar",
-                "lib/bots/UMSBot.jar",
-                "lib/bots/mayariBot.jar",  # "MindSeal.jar"
-            ]
-            for jar in jars:
-                jpype.addClassPath(os.path.join(self.microrts_path, jar))
-            jpype.startJVM(*jvm_args, convertStrings=False)
+        self.height, self.width = map_size(self.map_paths[0], self.microrts_path)
+
+        # launch the JVM, with only the bot jars of `ai2s` on its classpath
+        start_jvm(self.microrts_path, ais=ai2s, jvm_args=jvm_args, cds=jvm_cds)
 
         # start microrts client
         from rts.units import UnitTypeTable
 
         self.real_utt = UnitTypeTable()
+        self.rfs = self._make_reward_functions()
+        self.start_client()
+
+        # computed properties
+        # [num_planes_hp(5), num_planes_resources(5), num_planes_player(3),
+        # num_planes_unit_type(z), num_planes_unit_action(6), num_planes_terrain(2)]
+
+        self.num_planes = [5, 5, 3, len(self.utt["unitTypes"]) + 1, 6, 2]
+        if partial_obs:
+            self.num_planes = [5, 5, 3, len(self.utt["unitTypes"]) + 1, 6, 2, 1, 1]  # 2 extra for visibility
+        if self.obs_mode == "categorical":
+            # one index per feature group; single-plane groups (visibility) are binary flags
+            self.obs_plane_max = np.maximum(np.array(self.num_planes, dtype=np.int32) - 1, 1).reshape(1, -1, 1)
+            self.observation_space = gym.spaces.Box(
+                low=0,
+                high=np.broadcast_to(self.obs_plane_max.flatten(), (self.height, self.width, len(self.num_planes))),
+                dtype=np.uint8,
+            )
+        else:
+            self.obs_plane_max = np.array(self.num_planes, dtype=np.int32).reshape(1, -1, 1) - 1
+            self.observation_space = gym.spaces.Box(
+                low=0.0, high=1.0, shape=(self.height, self.width, sum(self.num_planes)), dtype=self.obs_dtype
+            )
+
+        self.num_planes_len = len(self.num_planes)
+        self.num_planes_prefix_sum = [0]
+        for num_plane in self.num_planes:
+            self.num_planes_prefix_sum.append(self.num_planes_prefix_sum[-1] + num_plane)
+
+        # pre-allocated buffers of the batched observation encoder
+        self.obs_plane_offsets = np.array(self.num_planes_prefix_sum[:-1], dtype=np.int32).reshape(1, -1, 1)
+        self.obs_cell_offsets = (
+            np.arange(self.num_envs * self.height * self.width, dtype=np.int64) * self.num_planes_prefix_sum[-1]
+        ).reshape(self.num_envs, 1, self.height * self.width)
+        self.raw_obs_buffer = np.zeros((self.num_envs, self.num_planes_len, self.height * self.width), dtype=np.int32)
+        self.obs_buffer = np.zeros((self.num_envs,) + self.observation_space.shape, dtype=self.observation_space.dtype)
+
+        self.action_space_dims = [6, 4, 4, 4, 4, len(self.utt["unitTypes"]), 7 * 7]
+        self.action_space = gym.spaces.MultiDiscrete(np.array([self.action_space_dims] * self.height * self.width).flatten())
+        self.action_plane_space = gym.spaces.MultiDiscrete(self.action_space_dims)
+        # masks of the units that can act in the current state, `None` until fetched for it
+        self.source_unit_mask = None
+        # (env ids, cell ids) of the units that can act, as returned by `get_sparse_action_mask`
+        self.sparse_cells = None
+        # the last masks fetched from each client, of shape [its envs, map height * width, 1 + action types + params],
+        # `None` when the client was reset or stepped since
+        self.client_masks = [None] * len(self.client_slices)
+
+    def _make_reward_functions(self):
         from ai.reward import (
             AttackRewardFunction,
             ProduceBuildingRewardFunction,
@@ -130,7 +288,7 @@ class MicroRTSGridModeVecEnv:
             WinLossRewardFunction,
         )
 
-        self.rfs = JArray(RewardFunctionInterface)(
+        return JArray(RewardFunctionInterface)(
             [
                 WinLossRewardFunction(),
                 ResourceGatherRewardFunction(),
@@ -141,115 +299,248 @@ class MicroRTSGridModeVecEnv:
                 # CloserToEnemyBaseRewardFunction(),
             ]
         )
-        self.start_client()
-
-        # computed properties
-        # [num_planes_hp(5), num_planes_resources(5), num_planes_player(3),
-        # num_planes_unit_type(z), num_planes_unit_action(6), num_planes_terrain(2)]
-
-        self.num_planes = [5, 5, 3, len(self.utt["unitTypes"]) + 1, 6, 2]
-        if partial_obs:
-            self.num_planes = [5, 5, 3, len(self.utt["unitTypes"]) + 1, 6, 2, 1, 1]  # 2 extra for visibility
-        self.observation_space = gym.spaces.Box(
-            low=0.0, high=1.0, shape=(self.height, self.width, sum(self.num_planes)), dtype=np.int32
-        )
 
-        self.num_planes_len = len(self.num_planes)
-        self.num_planes_prefix_sum = [0]
-        for num_plane in self.num_planes:
-            self.num_planes_prefix_sum.append(self.num_planes_prefix_sum[-1] + num_plane)
+    def _client_games(self, start, stop):
+        """
+        :return: (num selfplay envs, bot env start, bot env stop) of the client of envs [start, stop),
+        the bot envs (and `ai2s`) being indexed after the selfplay envs
+        """
+        bot_start = max(start, self.num_selfplay_envs) - self.num_selfplay_envs
+        bot_stop = max(stop, self.num_selfplay_envs) - self.num_selfplay_envs
+        return stop - start - (bot_stop - bot_start), bot_start, bot_stop
+
+    def _register_clients(self, vec_clients):
+        self.vec_clients = vec_clients
+        self.vec_client = vec_clients[0]
+        self.selfplay_clients = [client for vec_client in vec_clients for client in vec_client.selfPlayClients]
+        self.bot_clients = [client for vec_client in vec_clients for client in vec_client.clients]
+        self.render_client = self.selfplay_clients[0] if len(self.selfplay_clients) > 0 else self.bot_clients[0]
+        # get the unit type table
+        self.utt = json.loads(str(self.render_client.sendUTT()))
 
-        self.action_space_dims = [6, 4, 4, 4, 4, len(self.utt["unitTypes"]), 7 * 7]
-        self.action_space = gym.spaces.MultiDiscrete(np.array([self.action_space_dims] * self.height * self.width).flatten())
-        self.action_plane_space = gym.spaces.MultiDiscrete(self.action_space_dims)
-        self.source_unit_idxs = np.tile(np.arange(self.height * self.width), (self.num_envs, 1))
-        self.source_unit_idxs = self.source_unit_idxs.reshape((self.source_unit_idxs.shape + (1,)))
+    def _map_clients(self, fn):
+        """
+        Calls `fn(client_idx)` for every vec client, in parallel on the thread pool when there
+        are several of them (see `num_threads`).
+        :return: the list of results, in client order
+        """
+        if len(self.vec_clients) == 1:
+            return [fn(0)]
+        return list(self.thread_pool.map(fn, range(len(self.vec_clients))))
 
     def start_client(self):
 
         from ai.core import AI
         from ts import JNIGridnetVecClient as Client
 
-        self.vec_client = Client(
-            self.num_selfplay_envs,
-            self.num_bot_envs,
-            self.max_steps,
-            self.rfs,
-            os.path.expanduser(self.microrts_path),
-            self.map_paths,
-            JArray(AI)([ai2(self.real_utt) for ai2 in self.ai2s]),
-            self.real_utt,
-            self.partial_obs,
-        )
-        self.render_client = (
-            self.vec_client.selfPlayClients[0] if len(self.vec_client.selfPlayClients) > 0 else self.vec_client.clients[0]
-        )
-        # get the unit type table
-        self.utt = json.loads(str(self.render_client.sendUTT()))
+        vec_clients = []
+        for i, (start, stop) in enumerate(self.client_slices):
+            num_selfplay_envs, bot_start, bot_stop = self._client_games(start, stop)
+            vec_clients.append(
+                Client(
+                    num_selfplay_envs,
+                    bot_stop - bot_start,
+                    self.max_steps,
+                    # the reward functions keep per-game state, every client needs its own
+                    self.rfs if i == 0 else self._make_reward_functions(),
+                    os.path.expanduser(self.microrts_path),
+                    self.map_paths[start:stop],
+                    JArray(AI)([ai2(self.real_utt) for ai2 in self.ai2s[bot_start:bot_stop]]),
+                    self.real_utt,
+                    self.partial_obs,
+                )
+            )
+        self._register_clients(vec_clients)
+
+    def _set_map_path(self, env_idx, map_path):
+        """
+        Sets the map loaded by the next reset of the game played in `env_idx`
+        (both players of a selfplay game share it).
+        """
+        if env_idx < self.num_selfplay_envs:
+            self.selfplay_clients[env_idx // 2].mapPath = map_path
+        else:
+            self.bot_clients[env_idx - self.num_selfplay_envs].mapPath = map_path
+
+    def _queue_next_map(self, env_idxs):
+        # the JVM resets finished games itself inside `gameStep` (and returns the first
+        # observation of the next episode), so the next map is set up ahead of that reset
+        for env_idx in env_idxs:
+            self._set_map_path(env_idx, next(self.next_map))
+
+    def _queue_next_map_on_done(self, done, env_ids=None):
+        done_idxs = np.flatnonzero(done) if env_ids is None else env_ids[done]
+        self._queue_next_map(done_idxs[(done_idxs >= self.num_selfplay_envs) | (done_idxs % 2 == 0)])
 
     def reset(self):
-        responses = self.vec_client.reset([0] * self.num_envs)
-        obs = [self._encode_obs(np.array(ro)) for ro in responses.observation]
+        """
+        :return: the first observations, of shape [num_envs] + observation_space.shape. They are a view
+        of a buffer that the next `reset` or `step` overwrites, so copy them to keep them.
+        """
+        self._check_no_pending_clients()
 
-        return np.array(obs)
+        def reset_client(i):
+            start, stop = self.client_slices[i]
+            return np.asarray(self.vec_clients[i].reset([0] * (stop - start)).observation)
+
+        t = time.perf_counter()
+        obs = _concatenate(self._map_clients(reset_client))
+        self.source_unit_mask = None
+        self.client_masks = [None] * len(self.client_slices)
+        self.sparse_cells = None
+        if len(self.cycle_maps) > 0:
+            self._queue_next_map(self.game_env_idxs)
+        obs = self._encode_obs_batch(obs)
+        self.perf.record("reset", t)
+        return obs
 
-    def _encode_obs(self, obs):
-        obs = obs.reshape(len(obs), -1).clip(0, np.array([self.num_planes]).T - 1)
-        obs_planes = np.zeros((self.height * self.width, self.num_planes_prefix_sum[-1]), dtype=np.int32)
-        obs_planes_idx = np.arange(len(obs_planes))
-        obs_planes[obs_planes_idx, obs[0]] = 1
+    def reset_with_masks(self):
+        """
+        Same as `reset`, but also returns the action masks of the first observation.
+        :return: (obs, action masks)
+        """
+        obs = self.reset()
+        return obs, self.get_action_mask()
 
-        for i in range(1, self.num_planes_len):
-            obs_planes[obs_planes_idx, obs[i] + self.num_planes_prefix_sum[i]] = 1
-        return obs_planes.reshape(self.height, self.width, -1)
+    def _encode_obs_batch(self, obs, start=0):
+        """
+        Encode the raw observations of several environments into one-hot feature planes
+        with a single scatter (or into per-group feature indices if `obs_mode="categorical"`).
+        The result is written into (and is a view of) a buffer that is reused across calls.
+        :param obs: raw feature indices, of shape [num_envs, num feature groups, map height, map width]
+        :param start: index of the first env of `obs`, encoding disjoint slices of envs is thread-safe
+        :return: the encoded observation, of shape [num_envs] + observation_space.shape
+        """
+        num_envs = len(obs)
+        raw_obs = self.raw_obs_buffer[start : start + num_envs]
+        np.clip(obs.reshape(raw_obs.shape), 0, self.obs_plane_max, out=raw_obs)
+        out = self.obs_buffer[start : start + num_envs]
+        if self.obs_mode == "categorical":
+            raw_obs = raw_obs.reshape(num_envs, self.num_planes_len, self.height, self.width)
+            np.copyto(out, raw_obs.transpose(0, 2, 3, 1), casting="unsafe")
+            return out
+        raw_obs += self.obs_plane_offsets
+        out.fill(0)
+        out.reshape(-1)[raw_obs + self.obs_cell_offsets[:num_envs]] = 1
+        return out
 
     def step_async(self, actions):
+        self._check_no_pending_clients()
         actions = actions.reshape((self.num_envs, self.width * self.height, -1))
-        actions = np.concatenate((self.source_unit_idxs, actions), 2)  # specify source unit
-        # valid actions
-        actions = actions[np.where(self.source_unit_mask == 1)]
-        action_counts_per_env = self.source_unit_mask.sum(1)
-        java_actions = [None] * len(action_counts_per_env)
-        action_idx = 0
-        for outer_idx, action_count in enumerate(action_counts_per_env):
-            java_valid_action = [None] * action_count
-            for idx in range(action_count):
-                java_valid_action[idx] = JArray(JInt)(actions[action_idx])
-                action_idx += 1
-            java_actions[outer_idx] = JArray(JArray(JInt))(java_valid_action)
-        self.actions = JArray(JArray(JArray(JInt)))(java_actions)
+        if self.source_unit_mask is None:
+            # the masks were not fetched since the last step, so look up which units can act
+            self.get_action_mask()
+        t = time.perf_counter()
+        self.actions = [
+            to_java_actions(actions[start:stop], self.source_unit_mask[start:stop]) for start, stop in self.client_slices
+        ]
+        self.perf.record("step_async", t)
+
+    def _step_client(self, i, java_actions):
+        start, stop = self.client_slices[i]
+        t = time.perf_counter()
+        responses = self.vec_clients[i].gameStep(java_actions, [0] * (stop - start))
+        self.perf.record("jvm_step", t)
+        return responses
 
     def step_wait(self):
-        responses = self.vec_client.gameStep(self.actions, [0] * self.num_envs)
-        reward, done = np.array(responses.reward), np.array(responses.done)
-        obs = [self._encode_obs(np.array(ro)) for ro in responses.observation]
+        """
+        :return: (obs, reward, done, infos). Like those of `reset`, the observations are a view of a
+        buffer that the next `reset` or `step` overwrites.
+        """
+        self._check_no_pending_clients()
+
+        def step_client(i):
+            responses = self._step_client(i, self.actions[i])
+            return np.asarray(responses.observation), np.array(responses.reward), np.array(responses.done)
+
+        t = time.perf_counter()
+        obs, reward, done = map(_concatenate, zip(*self._map_clients(step_client)))
+        t = self.perf.record("game_step", t)
+        self.source_unit_mask = None
+        self.client_masks = [None] * len(self.client_slices)
+        self.sparse_cells = None
+        obs = self._encode_obs_batch(obs)
+        t = self.perf.record("encode_obs", t)
         infos = [{"raw_rewards": item} for item in reward]
         # check if it is in evaluation, if not, then change maps
         if len(self.cycle_maps) > 0:
-            # check if an environment is done, if done, reset the client, and replace the observation
-            for done_idx, d in enumerate(done[:, 0]):
-                # bot envs settings
-                if done_idx < self.num_bot_envs:
-                    if d:
-                        self.vec_client.clients[done_idx].mapPath = next(self.next_map)
-                        response = self.vec_client.clients[done_idx].reset(0)
-                        obs[done_idx] = self._encode_obs(np.array(response.observation))
-                # selfplay envs settings
-                else:
-                    if d and done_idx % 2 == 0:
-                        done_idx -= self.num_bot_envs  # recalibrate the index
-                        self.vec_client.selfPlayClients[done_idx // 2].mapPath = next(self.next_map)
-                        self.vec_client.selfPlayClients[done_idx // 2].reset()
-                        p0_response = self.vec_client.selfPlayClients[done_idx // 2].getResponse(0)
-                        p1_response = self.vec_client.selfPlayClients[done_idx // 2].getResponse(1)
-                        obs[done_idx] = self._encode_obs(np.array(p0_response.observation))
-                        obs[done_idx + 1] = self._encode_obs(np.array(p1_response.observation))
-        return np.array(obs), reward @ self.reward_weight, done[:, 0], infos
+            self._queue_next_map_on_done(done[:, 0])
+        reward = reward @ self.reward_weight
+        self.perf.record("infos", t)
+        return obs, reward, done[:, 0], infos
 
     def step(self, ac):
         self.step_async(ac)
         return self.step_wait()
 
+    def step_with_masks(self, ac):
+        """
+        Same as `step`, but also returns the action masks of the next observation, so
+        the next action can be sampled without a separate `get_action_mask` call.
+        :return: (obs, reward, done, infos, action masks)
+        """
+        obs, reward, done, infos = self.step(ac)
+        return obs, reward, done, infos, self.get_action_mask()
+
+    def step_sparse(self, actions):
+        """
+        Same as `step`, with only the actions of the cells returned by the last `get_sparse_action_mask`.
+        :param actions: of shape [number of these cells, action types + params]
+        """
+        self._check_no_pending_clients()
+        if self.sparse_cells is None:
+            raise RuntimeError("the units that can act are unknown, call `get_sparse_action_mask` first")
+        self._step_sparse_async(np.asarray(actions).reshape(len(self.sparse_cells[0]), -1))
+        return self.step_wait()
+
+    def _step_sparse_async(self, actions):
+        t = time.perf_counter()
+        env_ids, cell_ids = self.sparse_cells
+        # the cells are sorted by env, so each client's units are a slice of them
+        offsets = np.searchsorted(env_ids, [start for start, _ in self.client_slices] + [self.num_envs])
+        self.actions = [
+            to_java_unit_actions(env_ids[lo:hi] - start, cell_ids[lo:hi], actions[lo:hi], stop - start)
+            for (start, stop), lo, hi in zip(self.client_slices, offsets[:-1], offsets[1:])
+        ]
+        self.perf.record("step_async", t)
+
+    def perf_stats(self, clear=False):
+        """
+        :return: the timings of the phases of the env calls since the env was created (or last cleared),
+            as {phase: {"calls", "total_s", "mean_ms", "last_ms"}}. Empty unless the env is created
+            with `profile=True`. The phases are:
+            - `reset`: resetting all the envs and encoding the first observations
+            - `step_async`: converting the actions into java arrays (`send` in async mode)
+            - `game_step`: stepping all the clients, wall time (the clients step in parallel with `num_threads`)
+            - `jvm_step`: one `gameStep` of one client, i.e. the game ticks, the bots' thinking and the
+              observations and rewards computed in the JVM
+            - `encode_obs`: encoding the observations
+            - `infos`: weighting the rewards and building the infos
+            - `get_action_mask`: fetching the action masks
+            - `recv_wait`: waiting in `recv` for a client to be done
+        :param clear: clear the timings after reading them
+        """
+        stats = self.perf.summary()
+        if clear:
+            self.perf.clear()
+        return stats
+
+    def start_jfr_recording(self, path, settings="profile"):
+        """
+        Start a Java Flight Recorder recording of the JVM (the games, the bots and the reward functions),
+        written to `path` by `stop_jfr_recording`. Summarize it by bot and phase of the steps with
+        `python -m gym_microrts.microrts_jfr path`.
+        :param settings: the JFR configuration, "profile" or the lower overhead "default"
+        """
+        microrts_jfr.start_recording(path, settings)
+
+    def stop_jfr_recording(self):
+        """
+        :return: the path of the recording started by `start_jfr_recording`
+        """
+        return microrts_jfr.stop_recording()
+
     def getattr_depth_check(self, name, already_found):
         """
         Check if an attribute reference is being hidden in a recursive call to __getattr__
@@ -274,21 +565,152 @@ class MicroRTSGridModeVecEnv:
             return np.array(image)[:, :, ::-1]
 
     def close(self):
+        """
+        Close the game clients. The JVM keeps running, so the envs created next in this process
+        start in milliseconds, with their own maps and bots (see `microrts_jvm.shutdown_jvm`).
+        """
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown()
         if jpype._jpype.isStarted():
-            self.vec_client.close()
-            jpype.shutdownJVM()
+            for vec_client in self.vec_clients:
+                vec_client.close()
+        self.vec_clients = []
 
     def get_action_mask(self):
         """
         :return: Mask for action types and action parameters,
         of shape [num_envs, map height * width, action types + params]
         """
-        # action_mask shape: [num_envs, map height, map width, 1 + action types + params]
-        action_mask = np.array(self.vec_client.getMasks(0))
-        # self.source_unit_mask shape: [num_envs, map height * map width * 1]
-        self.source_unit_mask = action_mask[:, :, :, 0].reshape(self.num_envs, -1)
-        action_type_and_parameter_mask = action_mask[:, :, :, 1:].reshape(self.num_envs, self.height * self.width, -1)
-        return action_type_and_parameter_mask
+        self._check_no_pending_clients()
+        t = time.perf_counter()
+        self._map_clients(self._fetch_client_masks)
+        action_mask = _concatenate(self.client_masks)
+        self.source_unit_mask = action_mask[:, :, 0]
+        self.perf.record("get_action_mask", t)
+        return action_mask[:, :, 1:]
+
+    def get_sparse_action_mask(self):
+        """
+        Same as `get_action_mask`, restricted to the cells of the units that can act, usually a handful
+        of the map's cells, so that a policy only computes and samples the actions of these cells and
+        passes them to `step_sparse`.
+        :return: (env ids, cell ids, action masks of shape [number of cells, action types + params]),
+            sorted by env then cell, where `cell id = y * map width + x`
+        """
+        action_mask = self.get_action_mask()
+        self.sparse_cells = self._acting_cells()
+        return self.sparse_cells + (action_mask[self.sparse_cells],)
+
+    def _acting_cells(self):
+        return np.nonzero(self.source_unit_mask)
+
+    def _fetch_client_masks(self, i):
+        start, stop = self.client_slices[i]
+        # `np.asarray` reads the rectangular java array through its buffer into a new array, so the
+        # masks returned earlier are never overwritten
+        self.client_masks[i] = np.asarray(self.vec_clients[i].getMasks(0)).reshape(stop - start, self.height * self.width, -1)
+
+    def get_packed_action_mask(self):
+        """
+        :return: Mask for action types and action parameters bit-packed along the last axis
+        (`np.packbits`), of shape [num_envs, map height * width, ceil((action types + params) / 8)], uint8.
+        Unpack it with `np.unpackbits(mask, axis=-1, count=action types + params)` or on the
+        torch device with `gym_microrts.torch_utils.unpack_action_mask`.
+        """
+        return np.packbits(self.get_action_mask(), axis=-1)
+
+    def _check_no_pending_clients(self):
+        # the synchronous calls would step the clients stepped by `send` concurrently, over the same buffers
+        if len(self.pending_clients) > 0:
+            raise RuntimeError(f"clients {sorted(self.pending_clients)} have not been received yet, call `recv` first")
+
+    def _async_reset_client(self, i):
+        start, stop = self.client_slices[i]
+        responses = self.vec_clients[i].reset([0] * (stop - start))
+        self._encode_obs_batch(np.asarray(responses.observation), start=start)
+        self._fetch_client_masks(i)
+        return np.zeros((stop - start, len(self.rfs))), np.zeros((stop - start, 2), dtype=np.bool_)
+
+    def _async_step_client(self, i, java_actions):
+        start, stop = self.client_slices[i]
+        responses = self._step_client(i, java_actions)
+        t = time.perf_counter()
+        self._encode_obs_batch(np.asarray(responses.observation), start=start)
+        t = self.perf.record("encode_obs", t)
+        self._fetch_client_masks(i)
+        self.perf.record("get_action_mask", t)
+        return np.array(responses.reward), np.array(responses.done)
+
+    def _async_step_clients(self, clients, actions):
+        # the masks of the clients are fetched by `recv` and `get_action_mask`, but not by `reset` and `step`
+        for i, client_actions in zip(clients, actions):
+            if self.client_masks[i] is None:
+                self._fetch_client_masks(i)
+            t = time.perf_counter()
+            java_actions = to_java_actions(client_actions, self.client_masks[i][:, :, 0])
+            self.perf.record("step_async", t)
+            self.pending_clients[i] = self.thread_pool.submit(self._async_step_client, i, java_actions)
+
+    def _async_results(self, clients, env_ids):
+        return self.obs_buffer[env_ids], _concatenate([self.client_masks[i] for i in clients])[:, :, 1:]
+
+    def async_reset(self):
+        """
+        Starts resetting all the envs in the background, their first observations are returned by `recv`.
+        """
+        if len(self.pending_clients) > 0:
+            raise RuntimeError(f"clients {sorted(self.pending_clients)} have not been received yet")
+        self.source_unit_mask = None
+        for i in range(len(self.vec_clients)):
+            self.pending_clients[i] = self.thread_pool.submit(self._async_reset_client, i)
+
+    def send(self, actions, env_ids=None):
+        """
+        Starts stepping the envs `env_ids` in the background and returns immediately, so that
+        e.g. the policy can act on one half of the envs while the other half is stepping
+        (with `num_threads=2`).
+        :param actions: the actions of the envs `env_ids`, of shape [len(env_ids), map height * width * 7]
+        :param env_ids: the envs to step, which should make up whole clients (see `client_slices`).
+            Defaults to all the envs.
+        """
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids)
+        clients = [i for i, (start, stop) in enumerate(self.client_slices) if np.isin(np.arange(start, stop), env_ids).any()]
+        if not np.array_equal(np.sort(env_ids), np.concatenate([np.arange(*self.client_slices[i]) for i in clients])):
+            raise ValueError(f"env_ids should make up whole clients {self.client_slices}, got {env_ids}")
+        if not self.pending_clients.keys().isdisjoint(clients):
+            raise RuntimeError(f"clients {sorted(self.pending_clients.keys() & set(clients))} have not been received yet")
+        actions = actions.reshape((len(env_ids), self.height * self.width, -1))
+        # the actions are given in the order of `env_ids`, gather them per client
+        env_actions = actions[np.argsort(env_ids)]
+        client_actions, offset = [], 0
+        for i in clients:
+            start, stop = self.client_slices[i]
+            client_actions.append(env_actions[offset : offset + stop - start])
+            offset += stop - start
+        self.source_unit_mask = None
+        self._async_step_clients(clients, client_actions)
+
+    def recv(self):
+        """
+        Waits until at least one of the clients sent to is done, and collects every client that is done.
+        :return: (obs, reward, done, infos, action masks, env_ids) of the envs of the ready clients,
+            copied out of the reused buffers
+        """
+        if len(self.pending_clients) == 0:
+            raise RuntimeError("no client has been sent a command, call `send` or `async_reset` first")
+        t = time.perf_counter()
+        wait_futures(self.pending_clients.values(), return_when=FIRST_COMPLETED)
+        t = self.perf.record("recv_wait", t)
+        clients = sorted(i for i, future in self.pending_clients.items() if future.done())
+        reward, done = map(_concatenate, zip(*[self.pending_clients.pop(i).result() for i in clients]))
+        env_ids = np.concatenate([np.arange(*self.client_slices[i]) for i in clients])
+        obs, action_mask = self._async_results(clients, env_ids)
+        infos = [{"raw_rewards": item} for item in reward]
+        if len(self.cycle_maps) > 0:
+            self._queue_next_map_on_done(done[:, 0], env_ids)
+        reward = reward @ self.reward_weight
+        self.perf.record("infos", t)
+        return obs, reward, done[:, 0], infos, action_mask, env_ids
 
 
 class MicroRTSBotVecEnv(MicroRTSGridModeVecEnv):
@@ -305,6 +727,8 @@ class MicroRTSBotVecEnv(MicroRTSGridModeVecEnv):
         reward_weight=np.array([0.0, 1.0, 0.0, 0.0, 0.0, 5.0]),
         autobuild=True,
         jvm_args=[],
+        jvm_cds=False,
+        profile=False,
     ):
 
         self.ai1s = ai1s
@@ -316,6 +740,8 @@ class MicroRTSBotVecEnv(MicroRTSGridModeVecEnv):
         self.render_theme = render_theme
         self.map_paths = map_paths
         self.reward_weight = reward_weight
+        self.thread_pool = None
+        self.perf = PerfStats(enabled=profile)
 
         # read map
         self.microrts_path = os.path.join(gym_microrts.__path__[0], "microrts")
@@ -324,36 +750,14 @@ class MicroRTSBotVecEnv(MicroRTSGridModeVecEnv):
             os.system(f"git submodule update --init --recursive")
 
         if autobuild:
-            print(f"removing {self.microrts_path}/microrts.jar...")
-            if os.path.exists(f"{self.microrts_path}/microrts.jar"):
-                os.remove(f"{self.microrts_path}/microrts.jar")
-            print(f"building {self.microrts_path}/microrts.jar...")
-            root_dir = os.path.dirname(gym_microrts.__path__[0])
-            print(root_dir)
-            subprocess.run(["bash", "build.sh", "&>", "build.log"], cwd=f"{root_dir}")
-
-        root = ET.parse(os.path.join(self.microrts_path, self.map_paths[0])).getroot()
-        self.height, self.width = int(root.get("height")), int(root.get("width"))
-
-        # launch the JVM
-        if not jpype._jpype.isStarted():
-            registerDomain("ts", alias="tests")
-            registerDomain("ai")
-            registerDomain("rts")
-            jars = [
-                "microrts.jar",
-                "lib/bots/Coac.jar",
-                "lib/bots/Droplet.jar",
-                "lib/bots/GRojoA3N.jar",
-                "lib/bots/Izanagi.jar",
-                "lib/bots/MixedBot.jar",
-                "lib/bots/TiamatBot.jar",
-                "lib/bots/UMSBot.jar",
-                "lib/bots/mayariBot.jar",  # "MindSeal.jar"
-            ]
-            for jar in jars:
-                jpype.addClassPath(os.path.join(self.microrts_path, jar))
-            jpype.startJVM(*jvm_args, convertStrings=False)
+            # only rebuilds the jar when the java sources or bot jars have changed
+            build_microrts(self.microrts_path)
+
+        self.height, self.width = map_size(self.map_paths[0], self.microrts_path)
+
+        # launch the JVM, with only the bot jars of `ai1s` and `ai2s` on its classpath
+        registerDomain("rts")
+        start_jvm(self.microrts_path, ais=list(ai1s) + list(ai2s), jvm_args=jvm_args, cds=jvm_cds)
 
         # start microrts client
         from rts.units import UnitTypeTable
@@ -407,6 +811,7 @@ class MicroRTSBotVecEnv(MicroRTSGridModeVecEnv):
             self.real_utt,
             self.partial_obs,
         )
+        self.vec_clients = [self.vec_client]
         self.render_client = self.vec_client.botClients[0]
         # get the unit type table
         self.utt = json.loads(str(self.render_client.sendUTT()))
@@ -420,7 +825,9 @@ class MicroRTSBotVecEnv(MicroRTSGridModeVecEnv):
         self.actions = actions
 
     def step_wait(self):
+        t = time.perf_counter()
         responses = self.vec_client.gameStep(self.actions, [0 for _ in range(self.num_envs)])
+        self.perf.record("jvm_step", t)
         raw_obs, reward, done = np.ones((self.num_envs, 2)), np.array(responses.reward), np.array(responses.done)
         infos = [{"raw_rewards": item} for item in reward]
         return raw_obs, reward @ self.reward_weight, done[:, 0], infos
@@ -431,7 +838,10 @@ class MicroRTSGridModeSharedMemVecEnv(MicroRTSGridModeVecEnv):
     Similar function to `MicroRTSGridModeVecEnv` but uses shared mem buffers for
     zero-copy data exchange between NumPy and JVM runtimes. Drastically improves
     performance of the environment with some limitations introduced to the API.
-    Notably, all games should be performed on the same map.
+    Notably, all maps (including `cycle_maps`) should have the same size, since the
+    JVM lays out every game in the shared buffers with the stride of the first map,
+    and the one-hot observations are the int32 planes the JVM writes into the shared
+    buffer, so `obs_dtype` should be `np.int32`.
     """
 
     def __init__(
@@ -446,10 +856,13 @@ class MicroRTSGridModeSharedMemVecEnv(MicroRTSGridModeVecEnv):
         map_paths=["maps/10x10/basesTwoWorkers10x10.xml"],
         reward_weight=np.array([0.0, 1.0, 0.0, 0.0, 0.0, 5.0]),
         cycle_maps=[],
+        obs_mode="one_hot",
+        obs_dtype=np.int32,
+        num_threads=1,
+        profile=False,
     ):
-        if len(map_paths) > 1 and len(set(map_paths)) > 1:
-            raise ValueError("Mem shared environment requires all games to be played on the same map.")
-
+        if np.dtype(obs_dtype) != np.int32:
+            raise ValueError(f"the shared memory env only returns int32 observations, got obs_dtype={obs_dtype!r}")
         super(MicroRTSGridModeSharedMemVecEnv, self).__init__(
             num_selfplay_envs,
             num_bot_envs,
@@ -461,16 +874,28 @@ class MicroRTSGridModeSharedMemVecEnv(MicroRTSGridModeVecEnv):
             map_paths,
             reward_weight,
             cycle_maps,
+            obs_mode=obs_mode,
+            obs_dtype=obs_dtype,
+            num_threads=num_threads,
+            profile=profile,
         )
 
-    def _allocate_shared_buffer(self, nbytes):
+    def _allocate_shared_buffer(self, nbytes_per_env):
+        """
+        :return: (one JVM int buffer per vec client over its slice of envs, NumPy int32 view of all envs)
+        """
         from java.nio import ByteOrder
         from jpype.nio import convertToDirectBuffer
 
-        c_buffer = bytearray(nbytes)
-        jvm_buffer = convertToDirectBuffer(c_buffer).order(ByteOrder.nativeOrder()).asIntBuffer()
-        np_buffer = np.asarray(jvm_buffer, order="C")
-        return jvm_buffer, np_buffer
+        c_buffer = bytearray(self.num_envs * nbytes_per_env)
+        jvm_buffers = [
+            convertToDirectBuffer(memoryview(c_buffer)[start * nbytes_per_env : stop * nbytes_per_env])
+            .order(ByteOrder.nativeOrder())
+            .asIntBuffer()
+            for start, stop in self.client_slices
+        ]
+        np_buffer = np.frombuffer(c_buffer, dtype=np.int32)
+        return jvm_buffers, np_buffer
 
     def start_client(self):
 
@@ -478,6 +903,12 @@ class MicroRTSGridModeSharedMemVecEnv(MicroRTSGridModeVecEnv):
         from rts import GameState
         from ts import JNIGridnetSharedMemVecClient as Client
 
+        map_sizes = {}
+        for map_path in set(os.path.join(self.microrts_path, path) for path in self.map_paths) | set(self.cycle_maps):
+            map_sizes[map_path] = map_size(map_path, self.microrts_path)
+        if len(set(map_sizes.values())) > 1:
+            raise ValueError(f"Mem shared environment requires all maps to have the same (height, width), got {map_sizes}.")
+
         self.num_feature_planes = GameState.numFeaturePlanes
         num_unit_types = len(self.real_utt.getUnitTypes())
         self.action_space_dims = [6, 4, 4, 4, 4, num_unit_types, (self.real_utt.getMaxAttackRange() * 2 + 1) ** 2]
@@ -485,72 +916,141 @@ class MicroRTSGridModeSharedMemVecEnv(MicroRTSGridModeVecEnv):
         self.action_dim = len(self.action_space_dims)
 
         # pre-allocate shared buffers with JVM
-        obs_nbytes = self.num_envs * self.height * self.width * self.num_feature_planes * 4
-        obs_jvm_buffer, obs_np_buffer = self._allocate_shared_buffer(obs_nbytes)
+        obs_nbytes = self.height * self.width * self.num_feature_planes * 4
+        obs_jvm_buffers, obs_np_buffer = self._allocate_shared_buffer(obs_nbytes)
         self.obs = obs_np_buffer.reshape((self.num_envs, self.height, self.width, self.num_feature_planes))
 
-        action_mask_nbytes = self.num_envs * self.height * self.width * self.masks_dim * 4
-        action_mask_jvm_buffer, action_mask_np_buffer = self._allocate_shared_buffer(action_mask_nbytes)
+        action_mask_nbytes = self.height * self.width * self.masks_dim * 4
+        action_mask_jvm_buffers, action_mask_np_buffer = self._allocate_shared_buffer(action_mask_nbytes)
         self.action_mask = action_mask_np_buffer.reshape((self.num_envs, self.height * self.width, self.masks_dim))
 
-        action_nbytes = self.num_envs * self.width * self.height * self.action_dim * 4
-        action_jvm_buffer, action_np_buffer = self._allocate_shared_buffer(action_nbytes)
+        action_nbytes = self.width * self.height * self.action_dim * 4
+        action_jvm_buffers, action_np_buffer = self._allocate_shared_buffer(action_nbytes)
         self.actions = action_np_buffer.reshape((self.num_envs, self.height * self.width, self.action_dim))
 
-        self.vec_client = Client(
-            self.num_selfplay_envs,
-            self.num_bot_envs,
-            self.max_steps,
-            self.rfs,
-            os.path.expanduser(self.microrts_path),
-            self.map_paths[0],
-            JArray(AI)([ai2(self.real_utt) for ai2 in self.ai2s]),
-            self.real_utt,
-            self.partial_obs,
-            obs_jvm_buffer,
-            action_mask_jvm_buffer,
-            action_jvm_buffer,
-            0,
-        )
-        self.render_client = (
-            self.vec_client.selfPlayClients[0] if len(self.vec_client.selfPlayClients) > 0 else self.vec_client.clients[0]
-        )
-        # get the unit type table
-        self.utt = json.loads(str(self.render_client.sendUTT()))
+        vec_clients = []
+        for i, (start, stop) in enumerate(self.client_slices):
+            num_selfplay_envs, bot_start, bot_stop = self._client_games(start, stop)
+            vec_clients.append(
+                Client(
+                    num_selfplay_envs,
+                    bot_stop - bot_start,
+                    self.max_steps,
+                    # the reward functions keep per-game state, every client needs its own
+                    self.rfs if i == 0 else self._make_reward_functions(),
+                    os.path.expanduser(self.microrts_path),
+                    self.map_paths[0],
+                    JArray(AI)([ai2(self.real_utt) for ai2 in self.ai2s[bot_start:bot_stop]]),
+                    self.real_utt,
+                    self.partial_obs,
+                    obs_jvm_buffers[i],
+                    action_mask_jvm_buffers[i],
+                    action_jvm_buffers[i],
+                    0,
+                )
+            )
+        self._register_clients(vec_clients)
+
+        # the client is created with the first map, point every game to its own one
+        # (both players of a selfplay game play on the map of the first one)
+        for env_idx in self.game_env_idxs:
+            self._set_map_path(env_idx, os.path.join(self.microrts_path, self.map_paths[env_idx]))
 
     def reset(self):
-        self.vec_client.reset([0] * self.num_envs)
-        return self.obs
+        self._check_no_pending_clients()
+        t = time.perf_counter()
+        self._map_clients(lambda i: self.vec_clients[i].reset([0] * (self.client_slices[i][1] - self.client_slices[i][0])))
+        self.sparse_cells = None
+        if len(self.cycle_maps) > 0:
+            self._queue_next_map(self.game_env_idxs)
+        obs = self._get_obs()
+        self.perf.record("reset", t)
+        return obs
+
+    def _get_obs(self):
+        if self.obs_mode != "categorical":
+            return self.obs
+        # recover the per-group feature indices from the one-hot planes written by the JVM
+        for i in range(self.num_planes_len):
+            planes = self.obs[:, :, :, self.num_planes_prefix_sum[i] : self.num_planes_prefix_sum[i + 1]]
+            if planes.shape[-1] == 1:
+                np.copyto(self.obs_buffer[:, :, :, i], planes[:, :, :, 0], casting="unsafe")
+            else:
+                np.copyto(self.obs_buffer[:, :, :, i], planes.argmax(-1), casting="unsafe")
+        return self.obs_buffer
 
     def step_async(self, actions):
+        self._check_no_pending_clients()
+        t = time.perf_counter()
         actions = actions.reshape((self.num_envs, self.width * self.height, self.action_dim))
         np.copyto(self.actions, actions)
+        self.perf.record("step_async", t)
+
+    def _step_sparse_async(self, actions):
+        t = time.perf_counter()
+        # the JVM reads the actions of every cell of the shared buffer, the other cells get NOOPs
+        self.actions.fill(0)
+        self.actions[self.sparse_cells] = actions
+        self.perf.record("step_async", t)
+
+    def _step_shared_client(self, i):
+        start, stop = self.client_slices[i]
+        t = time.perf_counter()
+        responses = self.vec_clients[i].gameStep([0] * (stop - start))
+        self.perf.record("jvm_step", t)
+        return np.asarray(responses.reward), np.asarray(responses.done)
 
     def step_wait(self):
-        responses = self.vec_client.gameStep([0] * self.num_envs)
-        reward, done = np.array(responses.reward), np.array(responses.done)
+        """
+        :return: (obs, reward, done, infos). The observations are the shared buffer the JVM writes
+        into, which the next `reset` or `step` overwrites; the rewards and dones are new arrays.
+        """
+        self._check_no_pending_clients()
+        t = time.perf_counter()
+        reward, done = map(_concatenate, zip(*self._map_clients(self._step_shared_client)))
+        t = self.perf.record("game_step", t)
+        self.sparse_cells = None
         infos = [{"raw_rewards": item} for item in reward]
         # check if it is in evaluation, if not, then change maps
-        if len(self.cycle_maps) > 1:
-            # check if an environment is done, if done, reset the client, and replace the observation
-            for done_idx, d in enumerate(done[:, 0]):
-                # bot envs settings
-                if done_idx < self.num_bot_envs:
-                    if d:
-                        self.vec_client.clients[done_idx].mapPath = next(self.next_map)
-                        self.vec_client.clients[done_idx].reset(0)
-                        # self.obs[done_idx] = self._encode_obs(np.array(response.observation))
-                # selfplay envs settings
-                else:
-                    if d and done_idx % 2 == 0:
-                        done_idx -= self.num_bot_envs  # recalibrate the index
-                        self.vec_client.selfPlayClients[done_idx // 2].mapPath = next(self.next_map)
-                        self.vec_client.selfPlayClients[done_idx // 2].reset()
-                        # self.vec_client.selfPlayClients[done_idx // 2].reset()
-                        # self.obs[done_idx] = self._encode_obs(np.array(p0_response.observation))
-                        # self.obs[done_idx + 1] = self._encode_obs(np.array(p1_response.observation))
-        return self.obs, reward @ self.reward_weight, done[:, 0], infos
+        if len(self.cycle_maps) > 0:
+            self._queue_next_map_on_done(done[:, 0])
+        reward = reward @ self.reward_weight
+        t = self.perf.record("infos", t)
+        obs = self._get_obs()
+        self.perf.record("encode_obs", t)
+        return obs, reward, done[:, 0], infos
 
     def get_action_mask(self):
-        self.vec_client.getMasks(0)
+        self._check_no_pending_clients()
+        t = time.perf_counter()
+        self._map_clients(lambda i: self.vec_clients[i].getMasks(0))
+        self.perf.record("get_action_mask", t)
         return self.action_mask
+
+    def _acting_cells(self):
+        # the shared masks have no source unit plane, but NOOP is a valid action of every unit that can act
+        return np.nonzero(self.action_mask[:, :, 0])
+
+    def _async_reset_client(self, i):
+        start, stop = self.client_slices[i]
+        self.vec_clients[i].reset([0] * (stop - start))
+        self.vec_clients[i].getMasks(0)
+        return np.zeros((stop - start, len(self.rfs))), np.zeros((stop - start, 2), dtype=np.bool_)
+
+    def _async_step_client(self, i):
+        reward, done = self._step_shared_client(i)
+        t = time.perf_counter()
+        self.vec_clients[i].getMasks(0)
+        self.perf.record("get_action_mask", t)
+        return reward, done
+
+    def _async_step_clients(self, clients, actions):
+        for i, client_actions in zip(clients, actions):
+            start, stop = self.client_slices[i]
+            t = time.perf_counter()
+            np.copyto(self.actions[start:stop], client_actions)
+            self.perf.record("step_async", t)
+            self.pending_clients[i] = self.thread_pool.submit(self._async_step_client, i)
+
+    def _async_results(self, clients, env_ids):
+        return self._get_obs()[env_ids], self.action_mask[env_ids]
@@ -0,0 +1,114 @@
+import contextlib
+import hashlib
+import json
+import os
+import subprocess
+
+try:
+    import fcntl
+except ImportError:  # Windows, where concurrent builds are not guarded
+    fcntl = None
+
+import gym_microrts
+
+# the files `build.sh` compiles and packs into `microrts.jar`
+SOURCE_DIRS = ["src", "lib"]
+
+
+def source_paths(microrts_path):
+    """
+    :return: the paths of every file under `SOURCE_DIRS` of `microrts_path`, plus `build.sh`
+    """
+    paths = []
+    for source_dir in SOURCE_DIRS:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(microrts_path, source_dir)):
+            dirnames.sort()
+            paths += [os.path.join(dirpath, filename) for filename in sorted(filenames)]
+    root_dir = os.path.dirname(gym_microrts.__path__[0])
+    paths.append(os.path.join(root_dir, "build.sh"))
+    return [path for path in paths if os.path.isfile(path)]
+
+
+def stat_sources(microrts_path):
+    """
+    :return: the size and modification time of each of the `source_paths`, by relative path
+    """
+    stats = {}
+    for path in source_paths(microrts_path):
+        stat = os.stat(path)
+        stats[os.path.relpath(path, microrts_path)] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def hash_sources(microrts_path):
+    """
+    :return: the sha256 hex digest of the relative paths and contents of the `source_paths`
+    """
+    digest = hashlib.sha256()
+    for path in source_paths(microrts_path):
+        digest.update(os.path.relpath(path, microrts_path).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_microrts(microrts_path, force=False):
+    """
+    Build `microrts.jar` with `build.sh`, unless it was already built from the current sources.
+    The hash of the sources is stored next to the jar (`microrts.jar.sha256`), and a file lock
+    (`microrts.jar.lock`) makes concurrent processes wait for a single build instead of racing.
+    The sources are only hashed when the size or modification time of one of them differs from
+    the manifest of their stats stored along the hash (`microrts.jar.stat`).
+    Installs without the java sources (e.g. from a wheel) keep their bundled jar.
+    :param force: rebuild even if the jar is up to date
+    :return: whether the jar was built
+    """
+    jar_path = os.path.join(microrts_path, "microrts.jar")
+    hash_path = f"{jar_path}.sha256"
+    stat_path = f"{jar_path}.stat"
+    if not os.path.isdir(os.path.join(microrts_path, "src")):
+        return False
+    with _file_lock(f"{jar_path}.lock"):
+        sources_stats = stat_sources(microrts_path)
+        if not force and os.path.exists(jar_path) and os.path.exists(hash_path):
+            if os.path.exists(stat_path):
+                with open(stat_path) as f:
+                    if json.load(f) == sources_stats:
+                        return False
+            sources_hash = hash_sources(microrts_path)
+            with open(hash_path) as f:
+                built_hash = f.read().strip()
+            if built_hash == sources_hash:
+                # only the stats changed (e.g. a fresh checkout), which is not worth a build
+                with open(stat_path, "w") as f:
+                    json.dump(sources_stats, f)
+                return False
+        else:
+            sources_hash = hash_sources(microrts_path)
+
+        print(f"removing {jar_path}...")
+        for path in [jar_path, hash_path, stat_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"building {jar_path}...")
+        root_dir = os.path.dirname(gym_microrts.__path__[0])
+        subprocess.run(["bash", "build.sh"], cwd=root_dir)
+        if os.path.exists(jar_path):
+            with open(hash_path, "w") as f:
+                f.write(sources_hash)
+            with open(stat_path, "w") as f:
+                json.dump(sources_stats, f)
+        return True
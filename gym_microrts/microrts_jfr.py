@@ -0,0 +1,142 @@
+"""
+Java Flight Recorder (JFR) recordings of the JVM running the games, to find the Java hotspots
+(bots' search, game state cloning, reward functions...) that are invisible from python:
+
+    envs.start_jfr_recording("microrts.jfr")
+    for _ in range(1000):
+        envs.step(actions)
+    envs.stop_jfr_recording()
+
+and summarize the recording by bot and by phase of the env step:
+
+    python -m gym_microrts.microrts_jfr microrts.jfr --top 10
+"""
+
+import argparse
+import collections
+import os
+
+import jpype
+import jpype.imports
+
+# the recording in progress, JFR records the whole JVM so there is at most one per process
+_recording = None
+
+# the phases of the steps, matched by the frames of the sampled stacks (`(class, method)`, outermost last)
+# in this order, after the bots. The JNI clients call the bots through `AI.getAction`, so a sample
+# of e.g. a game state cloned by a bot's search counts for the bot.
+PHASES = [
+    ("agent actions", lambda cls, method: cls.startswith("ai.jni.") and method == "getAction"),
+    ("observation", lambda cls, method: cls.startswith("ai.jni.") and method in ("getObservation", "computeInfo")),
+    ("reward", lambda cls, method: cls.startswith("ai.rewardfunction.")),
+    ("masks", lambda cls, method: method in ("getMasks", "getValidActionArray")),
+    ("game tick", lambda cls, method: cls.endswith("GameState") and method in ("cycle", "issueSafe")),
+    ("state clone", lambda cls, method: method == "clone"),
+    ("reset", lambda cls, method: cls.startswith("tests.") and method == "reset"),
+    ("client other", lambda cls, method: cls.startswith("tests.")),
+]
+
+
+def start_recording(path, settings="profile"):
+    """
+    Start a JFR recording of the running JVM, written to `path` by `stop_recording`.
+    :param settings: the JFR configuration, "profile" (method sampling every 10 ms) or "default"
+        (lower overhead, sampling every 20 ms)
+    """
+    global _recording
+    if _recording is not None:
+        raise RuntimeError(f"a JFR recording to {_recording[1]} is already in progress")
+    from jdk.jfr import Configuration, Recording
+
+    recording = Recording(Configuration.getConfiguration(settings))
+    recording.start()
+    _recording = (recording, os.path.abspath(path))
+
+
+def stop_recording():
+    """
+    Stop the JFR recording in progress and write it to its file.
+    :return: the path of the recording
+    """
+    global _recording
+    if _recording is None:
+        raise RuntimeError("no JFR recording is in progress, call `start_recording` first")
+    from java.nio.file import Paths
+
+    recording, path = _recording
+    _recording = None
+    recording.stop()
+    recording.dump(Paths.get(path))
+    recording.close()
+    return path
+
+
+def classify(frames):
+    """
+    :param frames: the (class, method) frames of a sampled stack, innermost first
+    :return: the bot ("bot <class>") or phase of the step the sample belongs to
+    """
+    for cls, method in reversed(frames):
+        if method == "getAction" and not cls.startswith("ai.jni."):
+            return f"bot {cls.rsplit('.', 1)[-1]}"
+    for phase, matches in PHASES:
+        if any(matches(cls, method) for cls, method in frames):
+            return phase
+    return "other"
+
+
+def summarize(path, top=10):
+    """
+    Count the method samples (`jdk.ExecutionSample`) of a JFR recording by bot and phase.
+    :param top: the number of hottest frames listed for each bot and phase
+    :return: {bot or phase: {"samples", "top_frames": [("class.method", samples)]}}, sorted by samples
+    """
+    if not jpype._jpype.isStarted():
+        jpype.startJVM(convertStrings=False)
+    from java.nio.file import Paths
+    from jdk.jfr.consumer import RecordingFile
+
+    samples = collections.Counter()
+    top_frames = collections.defaultdict(collections.Counter)
+    recording_file = RecordingFile(Paths.get(os.path.abspath(path)))
+    try:
+        while recording_file.hasMoreEvents():
+            event = recording_file.readEvent()
+            if str(event.getEventType().getName()) != "jdk.ExecutionSample" or event.getStackTrace() is None:
+                continue
+            frames = [
+                (str(frame.getMethod().getType().getName()), str(frame.getMethod().getName()))
+                for frame in event.getStackTrace().getFrames()
+            ]
+            if len(frames) == 0:
+                continue
+            phase = classify(frames)
+            samples[phase] += 1
+            top_frames[phase][".".join(frames[0])] += 1
+    finally:
+        recording_file.close()
+    return {
+        phase: {"samples": count, "top_frames": top_frames[phase].most_common(top)} for phase, count in samples.most_common()
+    }
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser(description="summarize a JFR recording of gym-microrts by bot and phase")
+    parser.add_argument('path', type=str,
+        help='the JFR recording, e.g. written by `envs.stop_jfr_recording()`')
+    parser.add_argument('--top', type=int, default=10,
+        help='the number of hottest frames listed for each bot and phase')
+    args = parser.parse_args()
+    # fmt: on
+
+    summary = summarize(args.path, args.top)
+    num_samples = sum(item["samples"] for item in summary.values())
+    print(f"{num_samples} samples in {args.path}\n")
+    print(f"{'bot / phase':>30} {'samples':>8} {'share':>7}")
+    for phase, item in summary.items():
+        print(f"{phase:>30} {item['samples']:>8} {item['samples'] / num_samples:>7.1%}")
+    for phase, item in summary.items():
+        print(f"\n{phase}:")
+        for frame, count in item["top_frames"]:
+            print(f"{count:>8} {count / item['samples']:>7.1%}  {frame}")
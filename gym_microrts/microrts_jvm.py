@@ -0,0 +1,157 @@
+import hashlib
+import os
+import warnings
+
+import jpype
+from jpype.imports import registerDomain
+
+from gym_microrts import microrts_ai
+
+# the AIs of `microrts_ai` whose classes are part of `microrts.jar`
+MICRORTS_JAR_AIS = [
+    "randomBiasedAI",
+    "randomAI",
+    "passiveAI",
+    "workerRushAI",
+    "lightRushAI",
+    "POLightRush",
+    "POWorkerRush",
+    "POHeavyRush",
+    "PORangedRush",
+    "naiveMCTSAI",
+]
+
+# the competition bots of `microrts_ai` and the jar each of them is loaded from
+BOT_JARS = {
+    "coacAI": "lib/bots/Coac.jar",
+    "droplet": "lib/bots/Droplet.jar",
+    "guidedRojoA3N": "lib/bots/GRojoA3N.jar",
+    "izanagi": "lib/bots/Izanagi.jar",
+    "mixedBot": "lib/bots/MixedBot.jar",
+    "tiamat": "lib/bots/TiamatBot.jar",
+    "mayari": "lib/bots/mayariBot.jar",
+}
+
+ALL_BOT_JARS = [
+    "lib/bots/Coac.jar",
+    "lib/bots/Droplet.jar",
+    "lib/bots/GRojoA3N.jar",
+    "lib/bots/Izanagi.jar",
+    "lib/bots/MixedBot.jar",
+    "lib/bots/TiamatBot.jar",
+    "lib/bots/UMSBot.jar",
+    "lib/bots/mayariBot.jar",  # "MindSeal.jar"
+]
+
+# The JVM is shared by all the envs of a process: it is started by the first env and kept
+# running when envs are closed, since JPype cannot start it again once it is shut down.
+
+# the jars on the classpath of the running JVM
+_classpath = []
+
+
+def required_bot_jars(ais=None):
+    """
+    :param ais: AI functions, e.g. `[microrts_ai.coacAI, microrts_ai.passiveAI]`. `None` stands for all the bots.
+    :return: the bot jars needed to create `ais`, relative to the microrts path. All of them
+    if one of `ais` is not a known function of `microrts_ai`.
+    """
+    if ais is None:
+        return list(ALL_BOT_JARS)
+    jars = []
+    for ai in ais:
+        name = getattr(ai, "__name__", None)
+        if getattr(ai, "__module__", None) != microrts_ai.__name__ or (name not in BOT_JARS and name not in MICRORTS_JAR_AIS):
+            return list(ALL_BOT_JARS)
+        if name in BOT_JARS and BOT_JARS[name] not in jars:
+            jars.append(BOT_JARS[name])
+    return jars
+
+
+def cds_archive_path(microrts_path, classpath):
+    """
+    :return: the path of the AppCDS archive of `classpath`. The archive is only valid for the
+    exact classpath and jar files it was dumped with, so both are part of its name.
+    """
+    digest = hashlib.sha256()
+    for jar in classpath:
+        digest.update(jar.encode())
+        if os.path.exists(jar):
+            digest.update(str(os.stat(jar).st_mtime_ns).encode())
+    return os.path.join(microrts_path, f"microrts-{digest.hexdigest()[:16]}.jsa")
+
+
+def jvm_major_version(jvm_path):
+    """
+    :param jvm_path: path of the `libjvm` shared library, e.g. `jpype.getDefaultJVMPath()`
+    :return: the major version of the JDK the library belongs to, read from the `release` file
+    of its home (e.g. 8 for "1.8.0_292", 17 for "17.0.2"), or `None` if it cannot be found.
+    """
+    home = os.path.dirname(os.path.abspath(jvm_path))
+    # `lib/server/libjvm.so` since JDK 9, `jre/lib/amd64/server/libjvm.so` before
+    for _ in range(5):
+        release_path = os.path.join(home, "release")
+        if os.path.isfile(release_path):
+            with open(release_path) as f:
+                for line in f:
+                    if line.startswith("JAVA_VERSION="):
+                        version = line.split("=", 1)[1].strip().strip('"').split(".")
+                        major = version[1] if version[0] == "1" and len(version) > 1 else version[0]
+                        return int(major) if major.isdigit() else None
+            return None
+        home = os.path.dirname(home)
+    return None
+
+
+def start_jvm(microrts_path, ais=None, jvm_args=[], cds=False):
+    """
+    Start the JVM with `microrts.jar` and only the bot jars needed by `ais` on the classpath.
+    If the JVM is already running, the missing bot jars are added to it instead, through
+    JPype's dynamic class loader.
+    :param ais: the AI functions that will be created, `None` to load all the bots
+    :param jvm_args: extra arguments of the JVM
+    :param cds: start the JVM from an AppCDS archive of the classes it loads. The archive is dumped
+        when the first JVM started with this classpath exits, and reused afterwards. Dynamic archives
+        need JDK 13+, on older (or unidentified) JDKs the JVM is started without CDS, with a warning.
+    :return: whether the JVM was started by this call
+    """
+    jars = [os.path.join(microrts_path, jar) for jar in required_bot_jars(ais)]
+    if jpype._jpype.isStarted():
+        for jar in jars:
+            if jar not in _classpath:
+                jpype.addClassPath(jar)
+                _classpath.append(jar)
+        return False
+
+    registerDomain("ts", alias="tests")
+    registerDomain("ai")
+    classpath = [os.path.join(microrts_path, "microrts.jar")] + jars
+    for jar in classpath:
+        jpype.addClassPath(jar)
+    _classpath[:] = classpath
+    jvm_args = list(jvm_args)
+    if cds:
+        # like `jpype.startJVM`, a first argument that is not an option is the path of the JVM
+        jvm_path = jvm_args[0] if len(jvm_args) > 0 and not jvm_args[0].startswith("-") else jpype.getDefaultJVMPath()
+        version = jvm_major_version(jvm_path)
+        if version is None or version < 13:
+            warnings.warn(f"AppCDS archives need JDK 13+, the JVM {jvm_path} (version {version}) is started without CDS")
+            cds = False
+    if cds:
+        archive_path = cds_archive_path(microrts_path, classpath)
+        if os.path.exists(archive_path):
+            jvm_args.append(f"-XX:SharedArchiveFile={archive_path}")
+        else:
+            jvm_args.append(f"-XX:ArchiveClassesAtExit={archive_path}")
+    jpype.startJVM(*jvm_args, convertStrings=False)
+    return True
+
+
+def shutdown_jvm():
+    """
+    Shut down the JVM, which JPype otherwise does when python exits. No env can be created
+    in this process afterwards.
+    """
+    if jpype._jpype.isStarted():
+        jpype.shutdownJVM()
+    _classpath.clear()
@@ -1,3 +1,10 @@
+import os
+import xml.etree.ElementTree as ET
+
+import gym_microrts
+
+MICRORTS_PATH = os.path.join(gym_microrts.__path__[0], "microrts")
+
 ALL16x16_MAPS = [
     "maps/16x16/basesWorkers16x16A.xml",
     "maps/16x16/basesWorkers16x16E.xml",
@@ -19,3 +26,73 @@ ALL16x16_MAPS = [
     "maps/16x16/basesWorkers16x16L.xml",
     "maps/16x16/EightBasesWorkers16x16.xml",
 ]
+
+
+# the parsed maps, by absolute path
+_maps = {}
+# the maps under `maps/` of each microrts path, by (height, width)
+_size_index = {}
+
+
+def load_map(map_path, microrts_path=MICRORTS_PATH):
+    """
+    Parse a map once, later calls return the cached result.
+    :param map_path: path relative to `microrts_path` (e.g. `maps/16x16/basesWorkers16x16A.xml`), or absolute
+    :return: a dict with the `path`, `height`, `width`, `terrain` (one char per cell, "1" for walls),
+        `players` (the starting resources of each player) and `units` (the count of each unit type)
+    """
+    path = os.path.join(microrts_path, map_path)
+    if path not in _maps:
+        root = ET.parse(path).getroot()
+        units = {}
+        for unit in root.find("units"):
+            units[unit.get("type")] = units.get(unit.get("type"), 0) + 1
+        _maps[path] = {
+            "path": map_path,
+            "height": int(root.get("height")),
+            "width": int(root.get("width")),
+            "terrain": root.findtext("terrain", "").strip(),
+            "players": [int(player.get("resources")) for player in root.find("players")],
+            "units": units,
+        }
+    return _maps[path]
+
+
+def map_size(map_path, microrts_path=MICRORTS_PATH):
+    """
+    :return: (height, width) of the map
+    """
+    map_info = load_map(map_path, microrts_path)
+    return map_info["height"], map_info["width"]
+
+
+def list_maps(microrts_path=MICRORTS_PATH):
+    """
+    :return: the paths of all the maps bundled under `maps/` of `microrts_path`, relative to it
+    """
+    map_paths = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(microrts_path, "maps")):
+        dirnames.sort()
+        map_paths += [
+            os.path.relpath(os.path.join(dirpath, filename), microrts_path)
+            for filename in sorted(filenames)
+            if filename.endswith(".xml")
+        ]
+    return map_paths
+
+
+def maps_by_size(height, width, microrts_path=MICRORTS_PATH):
+    """
+    :return: the paths of the bundled maps of size (`height`, `width`), e.g. to pick the `cycle_maps`
+    of a `MicroRTSGridModeSharedMemVecEnv`, which should all have the same size.
+    The bundled maps are parsed and indexed by size on the first call.
+    """
+    if microrts_path not in _size_index:
+        index = {}
+        for map_path in list_maps(microrts_path):
+            try:
+                index.setdefault(map_size(map_path, microrts_path), []).append(map_path)
+            except (ET.ParseError, AttributeError, TypeError, ValueError):
+                pass  # not a map of `rts.PhysicalGameState` (e.g. a trace)
+        _size_index[microrts_path] = index
+    return list(_size_index[microrts_path].get((height, width), []))
@@ -0,0 +1,117 @@
+import torch
+
+# the padding indices of `masked_multi_categorical`, by (nvec, device)
+_padding_cache = {}
+
+
+def unpack_action_mask(packed_mask, num_bits=78):
+    """
+    Unpack on the device of `packed_mask` the action masks returned by `get_packed_action_mask`.
+    :param packed_mask: uint8 tensor of shape [..., ceil(num_bits / 8)]
+    :param num_bits: the number of action types + params, i.e. `envs.action_plane_space.nvec.sum()`
+    :return: bool tensor of shape [..., num_bits]
+    """
+    bits = torch.tensor([128, 64, 32, 16, 8, 4, 2, 1], dtype=torch.uint8, device=packed_mask.device)
+    unpacked = torch.bitwise_and(packed_mask.unsqueeze(-1), bits).ne(0)
+    return unpacked.reshape(packed_mask.shape[:-1] + (-1,))[..., :num_bits]
+
+
+def reverse_discounted_cumsum(x, discounts):
+    """
+    Solve `y[t] = x[t] + discounts[t] * y[t + 1]` (with `y[num_steps] = 0`) along the first axis
+    with a parallel scan: log2(num_steps) vectorized steps instead of a python loop over the steps.
+    :param x: tensor of shape [num_steps, ...]
+    :param discounts: tensor of the shape of `x`, e.g. `gamma * (1 - next_done)`
+    :return: y, of the shape of `x`
+    """
+    y, discounts = x.clone(), discounts.clone()
+    offset = 1
+    # after each step, `y[t]` sums the terms `t` to `t + 2 * offset - 1`, discounted by `discounts[t]`
+    while offset < len(y):
+        y[:-offset] = y[:-offset] + discounts[:-offset] * y[offset:]
+        discounts[:-offset] = discounts[:-offset] * discounts[offset:]
+        offset *= 2
+    return y
+
+
+def compute_gae(rewards, values, dones, last_value, last_done, gamma, gae_lambda):
+    """
+    Generalized advantage estimation over a rollout.
+    :param rewards: tensor of shape [num_steps, num_envs]
+    :param values: the values of the observations, of shape [num_steps, num_envs]
+    :param dones: whether each observation is the first of an episode, of shape [num_steps, num_envs]
+    :param last_value: the value of the observation after the rollout, of shape [num_envs] or [1, num_envs]
+    :param last_done: whether that observation is the first of an episode, of shape [num_envs]
+    :return: (advantages, returns), of shape [num_steps, num_envs]
+    """
+    next_values = torch.cat([values[1:], last_value.reshape(1, -1)])
+    next_nonterminal = 1.0 - torch.cat([dones[1:], last_done.reshape(1, -1)])
+    deltas = rewards + gamma * next_values * next_nonterminal - values
+    advantages = reverse_discounted_cumsum(deltas, gamma * gae_lambda * next_nonterminal)
+    return advantages, advantages + values
+
+
+def compute_returns(rewards, values, dones, last_value, last_done, gamma):
+    """
+    Discounted returns over a rollout, bootstrapped with `last_value`. The arguments are the
+    ones of `compute_gae`.
+    :return: (advantages, returns), of shape [num_steps, num_envs]
+    """
+    next_nonterminal = 1.0 - torch.cat([dones[1:], last_done.reshape(1, -1)])
+    bootstrap = torch.zeros_like(rewards)
+    bootstrap[-1] = gamma * next_nonterminal[-1] * last_value.reshape(-1)
+    returns = reverse_discounted_cumsum(rewards + bootstrap, gamma * next_nonterminal)
+    return returns - values, returns
+
+
+def _padding(nvec, device):
+    key = (tuple(nvec), str(device))
+    if key not in _padding_cache:
+        nvec = torch.tensor(nvec, device=device)
+        component_idxs = torch.repeat_interleave(torch.arange(len(nvec), device=device), nvec)
+        starts = torch.cumsum(nvec, 0) - nvec
+        max_n = int(nvec.max())
+        # the index of each category in the flattened [len(nvec), max(nvec)] padded tensor
+        padded_idxs = component_idxs * max_n + torch.arange(int(nvec.sum()), device=device) - starts[component_idxs]
+        _padding_cache[key] = (component_idxs, padded_idxs, starts, max_n)
+    return _padding_cache[key]
+
+
+def _pad(x, padded_idxs, num_components, max_n):
+    padded = x.new_full(x.shape[:-1] + (num_components * max_n,), float("-inf"))
+    return padded.index_copy_(-1, padded_idxs, x).view(x.shape[:-1] + (num_components, max_n))
+
+
+def masked_multi_categorical(logits, masks, nvec, actions=None, mask_value=-1e8):
+    """
+    Sample (or evaluate) the masked multi-categorical actions of gridnet in one pass, instead of one
+    masked `Categorical` per component: the components are reduced together over a
+    [..., len(nvec), max(nvec)] tensor padded with `-inf` and sampled with the Gumbel-max trick.
+    As with `CategoricalMasked`, the invalid logits are replaced by `mask_value`, so a component
+    without any valid category is sampled uniformly over its `nvec[i]` categories.
+    :param logits: tensor of shape [..., sum(nvec)]
+    :param masks: the valid categories, bool or 0/1 tensor of shape [..., sum(nvec)]
+    :param nvec: the number of categories of each component, e.g. `envs.action_plane_space.nvec.tolist()`
+    :param actions: the actions to evaluate, of shape [..., len(nvec)]. Sampled if `None`.
+    :param mask_value: the logit of the invalid categories, a float or a 0-dim tensor
+    :return: (actions [..., len(nvec)], log-probs summed over the components [...],
+        entropies summed over the components [...])
+    """
+    component_idxs, padded_idxs, starts, max_n = _padding(nvec, logits.device)
+    logits = logits.masked_fill(masks.logical_not() if masks.dtype == torch.bool else masks == 0, mask_value)
+    # logsumexp of each component. The shifted logits are clamped since `exp` takes a slow path on
+    # large negative inputs (the masked logits), whose terms are negligible anyway
+    max_logits = _pad(logits.detach(), padded_idxs, len(nvec), max_n).amax(-1)
+    shifted_logits = logits - max_logits.index_select(-1, component_idxs)
+    sums = max_logits.new_zeros(max_logits.shape).index_add_(-1, component_idxs, shifted_logits.clamp(min=-80.0).exp())
+    # not `shifted_logits - log(sums)`: as with `CategoricalMasked`, the logits of a component without
+    # valid categories cancel out with its log-normalizer, so it adds nothing to the log-probs and entropies
+    log_probs = logits - (max_logits + sums.log()).index_select(-1, component_idxs)
+    if actions is None:
+        with torch.no_grad():
+            # the log-probs rather than the logits are perturbed, as the noise vanishes next to `mask_value`
+            gumbels = -torch.log(-torch.log(torch.rand_like(log_probs)))
+            actions = _pad(log_probs + gumbels, padded_idxs, len(nvec), max_n).argmax(-1)
+    log_prob = log_probs.gather(-1, actions.long() + starts).sum(-1)
+    entropy = -(log_probs.clamp(min=-80.0).exp() * log_probs).sum(-1)
+    return actions, log_prob, entropy
@@ -0,0 +1,41 @@
+import os
+
+from gym_microrts import microrts_build
+
+
+def test_build_microrts(tmp_path, monkeypatch):
+    microrts_path = tmp_path / "microrts"
+    (microrts_path / "src").mkdir(parents=True)
+    (microrts_path / "lib").mkdir()
+    (microrts_path / "src" / "Game.java").write_text("class Game {}")
+    (microrts_path / "lib" / "bot.jar").write_bytes(b"jar")
+
+    builds = []
+
+    def fake_build(args, cwd):
+        builds.append(args)
+        (microrts_path / "microrts.jar").write_bytes(b"built")
+
+    monkeypatch.setattr(microrts_build.subprocess, "run", fake_build)
+    hashes = []
+    hash_sources = microrts_build.hash_sources
+    monkeypatch.setattr(microrts_build, "hash_sources", lambda path: hashes.append(path) or hash_sources(path))
+
+    assert microrts_build.build_microrts(str(microrts_path))
+    assert os.path.exists(microrts_path / "microrts.jar.sha256")
+    assert os.path.exists(microrts_path / "microrts.jar.stat")
+    # nothing changed, the jar is reused without hashing the sources
+    assert not microrts_build.build_microrts(str(microrts_path))
+    assert len(builds) == 1 and len(hashes) == 1
+
+    # a touched source is hashed again, but the jar is still up to date
+    stat = os.stat(microrts_path / "src" / "Game.java")
+    os.utime(microrts_path / "src" / "Game.java", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not microrts_build.build_microrts(str(microrts_path))
+    assert not microrts_build.build_microrts(str(microrts_path))
+    assert len(builds) == 1 and len(hashes) == 2
+
+    (microrts_path / "src" / "Game.java").write_text("class Game { int turn; }")
+    assert microrts_build.build_microrts(str(microrts_path))
+    assert microrts_build.build_microrts(str(microrts_path), force=True)
+    assert len(builds) == 3
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+
+from gym_microrts import microrts_ai
+from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
+from gym_microrts.microrts_jvm import ALL_BOT_JARS, jvm_major_version, required_bot_jars
+
+
+def test_required_bot_jars():
+    assert required_bot_jars([microrts_ai.passiveAI, microrts_ai.workerRushAI]) == []
+    assert required_bot_jars([microrts_ai.coacAI, microrts_ai.passiveAI, microrts_ai.coacAI]) == ["lib/bots/Coac.jar"]
+    assert required_bot_jars([microrts_ai.coacAI, microrts_ai.droplet]) == ["lib/bots/Coac.jar", "lib/bots/Droplet.jar"]
+    # unknown AIs may need any of the bots
+    assert required_bot_jars([microrts_ai.coacAI, lambda utt: None]) == ALL_BOT_JARS
+    assert required_bot_jars(None) == ALL_BOT_JARS
+
+
+def test_jvm_major_version(tmp_path):
+    for version, libjvm, expected in [
+        ('"1.8.0_292"', "jre/lib/amd64/server/libjvm.so", 8),
+        ('"17.0.2"', "lib/server/libjvm.so", 17),
+        ('"25"', "lib/server/libjvm.dylib", 25),
+    ]:
+        home = tmp_path / str(expected)
+        (home / os.path.dirname(libjvm)).mkdir(parents=True)
+        (home / "release").write_text(f'IMPLEMENTOR="Eclipse Adoptium"\nJAVA_VERSION={version}\n')
+        assert jvm_major_version(str(home / libjvm)) == expected
+    assert jvm_major_version(str(tmp_path / "unknown" / "lib" / "server" / "libjvm.so")) is None
+
+
+def test_reuse_jvm_after_close():
+    # closing an env keeps the JVM running for the next ones, which may load other maps and bots
+    for ai, map_path in [
+        (microrts_ai.passiveAI, "maps/4x4/baseTwoWorkers4x4.xml"),
+        (microrts_ai.coacAI, "maps/10x10/basesWorkers10x10.xml"),
+    ]:
+        envs = MicroRTSGridModeVecEnv(
+            num_selfplay_envs=0,
+            num_bot_envs=1,
+            ai2s=[ai],
+            map_paths=[map_path],
+            reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        )
+        obs = envs.reset()
+        assert obs.shape[1:3] == (envs.height, envs.width)
+        envs.step(np.zeros((1, envs.height * envs.width * 7), dtype=np.int32))
+        envs.close()
+        envs.close()
+
+
+def test_classify_jfr_samples():
+    from gym_microrts.microrts_jfr import classify
+
+    client_step = [("tests.JNIGridnetVecClient", "gameStep"), ("tests.JNIGridnetClient", "gameStep")]
+    # a game state cloned by a bot counts for the bot, the outermost `getAction` being the bot
+    bot_clone = [("rts.GameState", "clone"), ("ai.coac.CoacAI", "getAction")] + client_step
+    assert classify(bot_clone) == "bot CoacAI"
+    assert classify([("rts.GameState", "cycle")] + client_step) == "game tick"
+    assert (
+        classify([("rts.GameState", "clone"), ("ai.rewardfunction.AttackRewardFunction", "computeReward")] + client_step)
+        == "reward"
+    )
+    assert classify([("ai.jni.JNIAI", "getAction")] + client_step) == "agent actions"
+    assert classify([("java.lang.Thread", "run")]) == "other"
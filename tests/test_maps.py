@@ -0,0 +1,16 @@
+from gym_microrts import microrts_maps
+
+
+def test_map_registry():
+    map_info = microrts_maps.load_map("maps/16x16/basesWorkers16x16A.xml")
+    assert (map_info["height"], map_info["width"]) == (16, 16)
+    assert map_info["players"] == [5, 5]
+    assert map_info["units"] == {"Resource": 4, "Base": 2, "Worker": 2}
+    assert len(map_info["terrain"]) == 16 * 16
+    # the parsed maps are cached
+    assert microrts_maps.load_map("maps/16x16/basesWorkers16x16A.xml") is map_info
+
+    assert microrts_maps.map_size("maps/4x4/baseTwoWorkers4x4.xml") == (4, 4)
+    maps_16x16 = microrts_maps.maps_by_size(16, 16)
+    assert set(microrts_maps.ALL16x16_MAPS) <= set(maps_16x16)
+    assert all(microrts_maps.map_size(map_path) == (16, 16) for map_path in maps_16x16)
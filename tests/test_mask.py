@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 
 from gym_microrts import microrts_ai
 from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
@@ -83,3 +84,216 @@ def test_mask():
         ]).astype(np.int32),
     )
     # fmt: on
+
+
+def test_step_with_masks():
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=1,
+        max_steps=2000,
+        render_theme=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(1)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+    )
+    obs, masks = envs.reset_with_masks()
+    np.testing.assert_array_equal(np.array(masks), np.array(envs.get_action_mask()))
+
+    # `step` works without fetching the masks first
+    action = np.zeros(len(envs.action_space.nvec), np.int32)
+    envs.step(action)
+    obs, reward, done, infos, masks = envs.step_with_masks(action)
+    assert len(obs) == len(reward) == len(done) == len(infos) == len(masks) == 1
+    next_masks = envs.get_action_mask()
+    np.testing.assert_array_equal(masks, next_masks)
+    # each call returns a new array, the masks kept from a previous step are not overwritten
+    assert not np.shares_memory(masks, next_masks)
+
+
+def test_packed_mask():
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=1,
+        max_steps=2000,
+        render_theme=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(1)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+    )
+    envs.reset()
+    mask = np.array(envs.get_action_mask())
+    packed_mask = envs.get_packed_action_mask()
+    assert packed_mask.shape == (1, 16, 10) and packed_mask.dtype == np.uint8
+    np.testing.assert_array_equal(np.unpackbits(packed_mask, axis=-1, count=mask.shape[-1]), mask)
+
+
+def test_sparse_action_mask():
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=2,
+        max_steps=2000,
+        render_theme=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(2)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        num_threads=2,
+    )
+    envs.reset()
+    mask = np.array(envs.get_action_mask())
+    env_ids, cell_ids, sparse_mask = envs.get_sparse_action_mask()
+    # the base and the two workers of each env
+    assert list(env_ids) == [0, 0, 0, 1, 1, 1] and list(cell_ids) == [1, 4, 5, 1, 4, 5]
+    np.testing.assert_array_equal(sparse_mask, mask[env_ids, cell_ids])
+
+    obs, reward, done, infos = envs.step_sparse(np.zeros((len(cell_ids), len(envs.action_plane_space.nvec)), np.int32))
+    assert len(obs) == len(reward) == len(done) == len(infos) == 2
+    # the acting cells are those of the state the actions were computed for
+    with pytest.raises(RuntimeError):
+        envs.step_sparse(np.zeros((len(cell_ids), len(envs.action_plane_space.nvec)), np.int32))
+
+
+def test_num_threads():
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=2,
+        num_bot_envs=2,
+        max_steps=2000,
+        render_theme=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(2)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        num_threads=2,
+    )
+    assert len(envs.vec_clients) == 2 and envs.client_slices == [(0, 2), (2, 4)]
+    obs, masks = envs.reset_with_masks()
+    # player 0 of the selfplay game and the bot envs play the same side of the same map
+    np.testing.assert_array_equal(obs[0], obs[2])
+    np.testing.assert_array_equal(masks[0], masks[3])
+
+    action = np.zeros((4, len(envs.action_space.nvec)), np.int32)
+    obs, reward, done, infos, masks = envs.step_with_masks(action)
+    assert len(obs) == len(reward) == len(done) == len(infos) == len(masks) == 4
+
+
+def test_send_recv():
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=2,
+        max_steps=2000,
+        render_theme=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(2)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        num_threads=2,
+    )
+    envs.async_reset()
+    ready_env_ids = []
+    while len(ready_env_ids) < 2:
+        obs, reward, done, infos, masks, env_ids = envs.recv()
+        ready_env_ids += list(env_ids)
+    assert sorted(ready_env_ids) == [0, 1]
+
+    # step the second half while "acting" on the first one
+    envs.send(np.zeros((1, len(envs.action_space.nvec)), np.int32), env_ids=[1])
+    envs.send(np.zeros((1, len(envs.action_space.nvec)), np.int32), env_ids=[0])
+    ready_env_ids, ready_masks = [], []
+    while len(ready_env_ids) < 2:
+        obs, reward, done, infos, masks, env_ids = envs.recv()
+        ready_env_ids += list(env_ids)
+        ready_masks.append(masks)
+    assert sorted(ready_env_ids) == [0, 1]
+    np.testing.assert_array_equal(np.concatenate(ready_masks), envs.get_action_mask()[ready_env_ids])
+
+
+def test_send_then_step():
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=2,
+        max_steps=2000,
+        render_theme=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(2)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        num_threads=2,
+    )
+    envs.async_reset()
+    ready_env_ids = []
+    while len(ready_env_ids) < 2:
+        ready_env_ids += list(envs.recv()[-1])
+
+    # the synchronous calls refuse to run while a client sent to has not been received
+    actions = np.zeros((2, len(envs.action_space.nvec)), np.int32)
+    envs.send(actions[1:], env_ids=[1])
+    with pytest.raises(RuntimeError):
+        envs.step(actions)
+    with pytest.raises(RuntimeError):
+        envs.get_action_mask()
+    with pytest.raises(RuntimeError):
+        envs.reset()
+    assert list(envs.recv()[-1]) == [1]
+
+    envs.get_action_mask()
+    obs, reward, done, infos = envs.step(actions)
+    assert obs.shape == (2, 4, 4, 29) and reward.shape == (2,)
+
+
+def test_step_then_send():
+    def make_envs():
+        return MicroRTSGridModeVecEnv(
+            num_selfplay_envs=0,
+            num_bot_envs=2,
+            max_steps=2000,
+            render_theme=2,
+            ai2s=[microrts_ai.passiveAI for _ in range(2)],
+            map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+            reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+            num_threads=2,
+        )
+
+    def last_valid_actions(masks):
+        # the last valid action type and parameters of each cell, so that the units move or act
+        components = np.split(masks, np.cumsum(envs.action_plane_space.nvec)[:-1], axis=-1)
+        return np.stack([c.shape[-1] - 1 - c[:, :, ::-1].argmax(-1) for c in components], -1).reshape(2, -1)
+
+    def send_and_recv(actions):
+        envs.send(actions)
+        obs, ready_env_ids = np.zeros_like(envs.obs_buffer), []
+        while len(ready_env_ids) < 2:
+            client_obs, reward, done, infos, masks, env_ids = envs.recv()
+            obs[env_ids] = client_obs
+            ready_env_ids += list(env_ids)
+        return obs
+
+    # `send` right after the synchronous `reset` and `step` acts on the units of the current state,
+    # like `step` does on an identical env
+    envs, sync_envs = make_envs(), make_envs()
+    envs.reset()
+    sync_envs.reset()
+    for _ in range(3):
+        actions = last_valid_actions(sync_envs.get_action_mask())
+        np.testing.assert_array_equal(send_and_recv(actions), sync_envs.step(actions)[0])
+        actions = last_valid_actions(sync_envs.get_action_mask())
+        np.testing.assert_array_equal(envs.step(actions)[0], sync_envs.step(actions)[0])
+
+
+def test_perf_stats():
+    envs = MicroRTSGridModeVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=2,
+        max_steps=2000,
+        render_theme=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(2)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        num_threads=2,
+        profile=True,
+    )
+    envs.reset()
+    for _ in range(3):
+        envs.step_with_masks(np.zeros((2, len(envs.action_space.nvec)), np.int32))
+    stats = envs.perf_stats(clear=True)
+    assert stats["game_step"]["calls"] == 3
+    # one `gameStep` per client
+    assert stats["jvm_step"]["calls"] == 6
+    for phase in ["reset", "step_async", "encode_obs", "infos", "get_action_mask"]:
+        assert stats[phase]["calls"] >= 1 and stats[phase]["total_s"] >= 0
+    assert envs.perf_stats() == {}
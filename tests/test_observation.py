@@ -1,6 +1,7 @@
 import numpy as np
+import pytest
 
-from gym_microrts.envs.vec_env import MicroRTSGridModeVecEnv
+from gym_microrts.envs.vec_env import MicroRTSGridModeSharedMemVecEnv, MicroRTSGridModeVecEnv
 
 render = False
 
@@ -106,3 +107,65 @@ def test_observation():
     # fmt: on
     next_obs = envs.reset()
     np.testing.assert_array_equal(next_obs[0][6][6], wall)
+
+
+def test_categorical_observation():
+    envs = MicroRTSGridModeVecEnv(
+        num_bot_envs=0,
+        num_selfplay_envs=2,
+        partial_obs=False,
+        max_steps=5000,
+        render_theme=2,
+        ai2s=[],
+        map_paths=["maps/16x16/basesWorkers16x16A.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        obs_mode="categorical",
+    )
+
+    # fmt: off
+    next_obs = envs.reset()
+    assert next_obs.shape == (2, 16, 16, 6) and next_obs.dtype == np.uint8
+    # [hp, resources, owner, unit type, current action, terrain]
+    resource = np.array([1, 4, 0, 1, 0, 0])
+    p1_worker = np.array([1, 0, 1, 4, 0, 0])
+    p1_base = np.array([4, 0, 1, 2, 0, 0])
+    p2_worker = np.array([1, 0, 2, 4, 0, 0])
+    empty_cell = np.array([0, 0, 0, 0, 0, 0])
+    # fmt: on
+
+    np.testing.assert_array_equal(next_obs[0][0][0], resource)
+    np.testing.assert_array_equal(next_obs[0][1][1], p1_worker)
+    np.testing.assert_array_equal(next_obs[0][2][2], p1_base)
+    np.testing.assert_array_equal(next_obs[0][14][14], p2_worker)
+    np.testing.assert_array_equal(next_obs[0][8][8], empty_cell)
+    np.testing.assert_array_equal(next_obs[1][1][1], p2_worker)
+    assert envs.observation_space.contains(next_obs[0])
+
+
+def test_observation_dtype():
+    envs = MicroRTSGridModeVecEnv(
+        num_bot_envs=0,
+        num_selfplay_envs=2,
+        partial_obs=False,
+        max_steps=5000,
+        render_theme=2,
+        ai2s=[],
+        map_paths=["maps/16x16/basesWorkers16x16A.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+        obs_dtype=np.uint8,
+    )
+    next_obs = envs.reset()
+    assert next_obs.dtype == np.uint8 and envs.observation_space.dtype == np.uint8
+    assert next_obs.sum(dtype=np.int64) == 3072
+
+
+def test_shared_mem_observation_dtype():
+    # the shared memory env returns the int32 planes written by the JVM
+    with pytest.raises(ValueError):
+        MicroRTSGridModeSharedMemVecEnv(
+            num_bot_envs=0,
+            num_selfplay_envs=2,
+            ai2s=[],
+            map_paths=["maps/16x16/basesWorkers16x16A.xml"],
+            obs_dtype=np.uint8,
+        )
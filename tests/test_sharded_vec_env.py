@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from gym_microrts import microrts_ai
+from gym_microrts.envs.sharded_vec_env import MicroRTSGridModeShardedVecEnv
+
+
+def test_sharded_vec_env():
+    envs = MicroRTSGridModeShardedVecEnv(
+        num_selfplay_envs=2,
+        num_bot_envs=2,
+        num_shards=2,
+        ai2s=[microrts_ai.passiveAI for _ in range(2)],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+    )
+    assert envs.shard_slices == [(0, 2), (2, 4)]
+    obs, masks = envs.reset_with_masks()
+    assert obs.shape == (4, 4, 4, 29)
+    assert masks.shape == (4, 16, 78)
+    # both players of the selfplay game and both bot envs start on the same map
+    np.testing.assert_array_equal(obs[0], obs[2])
+    np.testing.assert_array_equal(obs[2], obs[3])
+
+    actions = np.zeros((4, 16 * 7), dtype=np.int32)
+    obs, reward, done, infos, masks = envs.step_with_masks(actions)
+    assert reward.shape == (4,) and done.shape == (4,)
+    assert len(infos) == 4 and infos[0]["raw_rewards"].shape == (6,)
+    envs.close()
+
+
+def test_sharded_vec_env_async():
+    envs = MicroRTSGridModeShardedVecEnv(
+        num_selfplay_envs=0,
+        num_bot_envs=3,
+        num_shards=3,
+        ai2s=[microrts_ai.passiveAI, microrts_ai.randomBiasedAI, microrts_ai.coacAI],
+        map_paths=["maps/4x4/baseTwoWorkers4x4.xml"],
+        reward_weight=np.array([10.0, 1.0, 1.0, 0.2, 1.0, 4.0]),
+    )
+    envs.async_reset()
+    ready_env_ids = []
+    while len(ready_env_ids) < 3:
+        obs, reward, done, infos, masks, env_ids = envs.recv()
+        assert obs.shape == (len(env_ids), 4, 4, 29)
+        ready_env_ids += list(env_ids)
+    assert sorted(ready_env_ids) == [0, 1, 2]
+
+    envs.send(np.zeros((1, 16 * 7), dtype=np.int32), env_ids=[1])
+    # the synchronous calls refuse to run while a shard sent to has not been received
+    with pytest.raises(RuntimeError):
+        envs.step(np.zeros((3, 16 * 7), dtype=np.int32))
+    with pytest.raises(RuntimeError):
+        envs.get_action_mask()
+    obs, reward, done, infos, masks, env_ids = envs.recv()
+    np.testing.assert_array_equal(env_ids, [1])
+    envs.step(np.zeros((3, 16 * 7), dtype=np.int32))
+    envs.close()
@@ -0,0 +1,73 @@
+import numpy as np
+import torch
+from torch.distributions.categorical import Categorical
+
+from gym_microrts.torch_utils import compute_gae, compute_returns, masked_multi_categorical, unpack_action_mask
+
+
+def test_unpack_action_mask():
+    mask = np.random.RandomState(0).randint(0, 2, size=(3, 16, 78)).astype(np.int32)
+    packed_mask = np.packbits(mask, axis=-1)
+    assert packed_mask.shape == (3, 16, 10) and packed_mask.dtype == np.uint8
+
+    unpacked_mask = unpack_action_mask(torch.from_numpy(packed_mask), num_bits=78)
+    assert unpacked_mask.dtype == torch.bool
+    np.testing.assert_array_equal(unpacked_mask.numpy(), mask.astype(bool))
+
+
+def test_compute_gae():
+    num_steps, num_envs, gamma, gae_lambda = 37, 4, 0.99, 0.95
+    rewards, values = torch.randn(num_steps, num_envs), torch.randn(num_steps, num_envs)
+    dones = (torch.rand(num_steps, num_envs) < 0.1).float()
+    last_value, next_done = torch.randn(1, num_envs), torch.tensor([0.0, 1.0, 0.0, 1.0])
+
+    # the python loop over the steps of the PPO trainers
+    advantages = torch.zeros_like(rewards)
+    returns = torch.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(num_steps)):
+        if t == num_steps - 1:
+            nextnonterminal, nextvalues, next_return = 1.0 - next_done, last_value, last_value
+        else:
+            nextnonterminal, nextvalues, next_return = 1.0 - dones[t + 1], values[t + 1], returns[t + 1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advantages[t] = lastgaelam = delta + gamma * gae_lambda * nextnonterminal * lastgaelam
+        returns[t] = rewards[t] + gamma * nextnonterminal * next_return
+
+    gae_advantages, gae_returns = compute_gae(rewards, values, dones, last_value, next_done, gamma, gae_lambda)
+    torch.testing.assert_allclose(gae_advantages, advantages)
+    torch.testing.assert_allclose(gae_returns, advantages + values)
+    mc_advantages, mc_returns = compute_returns(rewards, values, dones, last_value, next_done, gamma)
+    torch.testing.assert_allclose(mc_returns, returns)
+    torch.testing.assert_allclose(mc_advantages, returns - values)
+
+
+def test_masked_multi_categorical():
+    nvec = [6, 4, 4, 4, 4, 7, 49]
+    logits = torch.randn(64, sum(nvec), requires_grad=True)
+    masks = torch.rand(64, sum(nvec)) < 0.5
+    masks[0, :6] = False  # a component without valid categories is uniform
+
+    actions, log_prob, entropy = masked_multi_categorical(logits, masks, nvec)
+    assert actions.shape == (64, len(nvec)) and log_prob.shape == entropy.shape == (64,)
+    split_masks = torch.split(masks, nvec, dim=-1)
+    for i, component_actions in enumerate(actions.T.tolist()):
+        assert all(split_masks[i][row, action] for row, action in enumerate(component_actions) if split_masks[i][row].any())
+
+    # one masked `Categorical` per component, as the gridnet agents did
+    categoricals = [
+        Categorical(logits=torch.where(component_masks, component_logits, torch.tensor(-1e8)))
+        for component_logits, component_masks in zip(torch.split(logits, nvec, dim=-1), split_masks)
+    ]
+    expected_log_prob = sum(categorical.log_prob(a) for categorical, a in zip(categoricals, actions.T))
+    expected_entropy = sum(categorical.entropy() for categorical in categoricals)
+    torch.testing.assert_allclose(log_prob, expected_log_prob)
+    torch.testing.assert_allclose(entropy, expected_entropy)
+
+    grad = torch.autograd.grad((log_prob + entropy).sum(), logits)[0]
+    expected_grad = torch.autograd.grad((expected_log_prob + expected_entropy).sum(), logits)[0]
+    torch.testing.assert_allclose(grad, expected_grad)
+
+    # evaluating given actions
+    _, given_log_prob, _ = masked_multi_categorical(logits, masks, nvec, actions=actions)
+    torch.testing.assert_allclose(given_log_prob, log_prob)